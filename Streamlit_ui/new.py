@@ -13,6 +13,7 @@ import faiss
 import numpy as np
 import logging
 import nltk
+import re
 from sentence_transformers import SentenceTransformer
 from pdf2image import convert_from_path
 import comtypes.client
@@ -22,6 +23,12 @@ logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(
 pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
 nltk.download('punkt', quiet=True)
 
+# Model context window (num_ctx) and the part of it kept free for the answer
+CONTEXT_WINDOW_TOKENS = int(os.environ.get("CONTEXT_WINDOW_TOKENS", "4096"))
+ANSWER_RESERVE_TOKENS = int(os.environ.get("ANSWER_RESERVE_TOKENS", "1536"))
+# Words and punctuation marks undercount subword tokens by roughly this factor
+TOKEN_ESTIMATE_FACTOR = 1.3
+
 # --- Core Functions ---
 def categorize_file(file_path):
     """Determine the file type based on extension."""
@@ -67,6 +74,19 @@ def process_pdf(file_path):
     return text or " ".join([pytesseract.image_to_string(img) 
                            for img in convert_from_path(file_path)])
 
+def fit_to_context(content, prompt):
+    """Trim file content to the tokens the context window has left, at a line or sentence end."""
+    tokens = list(re.finditer(r"\w+|[^\w\s]", content))
+    prompt_tokens = len(re.findall(r"\w+|[^\w\s]", prompt))
+    budget = int((CONTEXT_WINDOW_TOKENS - ANSWER_RESERVE_TOKENS) / TOKEN_ESTIMATE_FACTOR) - prompt_tokens - 32
+    if len(tokens) <= budget:
+        return content
+    if budget <= 0:
+        return ""
+    cut = tokens[budget].start()
+    boundary = max(content.rfind("\n", 0, cut), content.rfind(". ", 0, cut))
+    return content[:boundary + 1 if boundary > cut // 2 else cut].rstrip()
+
 def send_request(prompt, file_path=None):
     """Send request to Ollama API."""
     api_url = "http://localhost:11434/api/generate"
@@ -74,7 +94,7 @@ def send_request(prompt, file_path=None):
     if file_path:
         content = process_file(file_path)
         if content:
-            prompt += f"\n\nFile Content:\n{content[:3000]}"  # Limit context length
+            prompt += f"\n\nFile Content:\n{fit_to_context(content, prompt)}"
     
     try:
         response = requests.post(
@@ -0,0 +1,99 @@
+import asyncio
+import importlib
+import logging
+import os
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import FileResponse
+from fastapi.middleware.cors import CORSMiddleware
+from batch import start_batch, read_checkpoint, close_batches, BATCH_CONCURRENCY, BATCH_DIR
+from chunking import ensure_sentence_tokenizer
+from embeddings import warmup_embedding_model
+from ollama_client import close_ollama_client
+from uploads import receive_upload, get_job_manager, close_job_manager, UploadTooLarge, UPLOAD_DIR
+from workers import get_process_pool
+
+# Load models in the background at startup; turn off for quick reload loops
+PRELOAD_MODELS = os.environ.get("PRELOAD_MODELS", "1") == "1"
+
+def preload():
+    """Load what the first request would otherwise wait for; runs in a thread."""
+    try:
+        ensure_sentence_tokenizer()
+        # FAISS is imported on first use; pay for it here rather than on the first question
+        importlib.import_module("faiss")
+        # Load the embedding model once per process instead of once per upload
+        warmup_embedding_model()
+        # Spawn the extraction workers now rather than on the first PDF
+        get_process_pool().warmup()
+    except Exception as e:
+        logging.error(f"Preloading failed: {e}")
+
+@asynccontextmanager
+async def lifespan(app):
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    if PRELOAD_MODELS:
+        # Not awaited: the server accepts connections straight away, and a request
+        # that needs the model before it is loaded waits for it
+        app.state.preload = asyncio.get_running_loop().run_in_executor(None, preload)
+    yield
+    await close_batches()
+    await close_ollama_client()
+    await close_job_manager()
+    # Worker processes must be gone before a server worker process can exit
+    get_process_pool().close()
+
+def create_app():
+    """FastAPI app with the middleware, lifecycle, job and batch routes every server shares.
+
+    Callers add their own /ws and /upload handlers.
+    """
+    app = FastAPI(lifespan=lifespan)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+
+    @app.get("/jobs/{job_id}")
+    async def job_status(job_id: str):
+        state = get_job_manager().status(job_id)
+        if state is None:
+            raise HTTPException(status_code=404, detail="Unknown job")
+        return state
+
+    def batch_output(batch_id):
+        return os.path.join(BATCH_DIR, f"{os.path.basename(batch_id)}.results.jsonl")
+
+    @app.post("/batch")
+    async def submit_batch(request: Request):
+        # Multipart form with the JSONL as `file` and an optional `concurrency`.
+        # The batch is named by the input's hash, so posting the same file again
+        # resumes it (or reports on it) instead of answering everything twice
+        try:
+            input_path, batch_id, _, _, fields = await receive_upload(request, directory=BATCH_DIR)
+            concurrency = int(fields.get("concurrency", BATCH_CONCURRENCY))
+        except UploadTooLarge as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        report = await start_batch(input_path, batch_output(batch_id), concurrency)
+        return dict(report or {}, batch_id=batch_id)
+
+    @app.get("/batch/{batch_id}")
+    async def batch_status(batch_id: str):
+        report = read_checkpoint(batch_output(batch_id))
+        if report is None:
+            raise HTTPException(status_code=404, detail="Unknown batch")
+        return dict(report, batch_id=batch_id)
+
+    @app.get("/batch/{batch_id}/results")
+    async def batch_results(batch_id: str):
+        output = batch_output(batch_id)
+        if not os.path.exists(output):
+            raise HTTPException(status_code=404, detail="Unknown batch")
+        return FileResponse(output, media_type="application/x-ndjson", filename=f"{batch_id}.jsonl")
+
+    return app
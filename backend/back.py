@@ -1,46 +1,16 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, UploadFile, File, Form
-from fastapi.middleware.cors import CORSMiddleware
-from main import send_request, process_file  # Import from your existing main.py
+from fastapi import Request, WebSocket, WebSocketDisconnect, HTTPException
+from main import async_send_request, async_stream_request  # Import from your existing main.py
+from app_factory import create_app
+from connections import ConnectionManager
+from uploads import receive_upload, get_job_manager, UploadTooLarge
+from scheduler import INTERACTIVE
 import logging
-import json
-import os
 from datetime import datetime
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 
-app = FastAPI()
-
-# Create uploads directory if it doesn't exist
-UPLOAD_DIR = "uploads"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: list[WebSocket] = []
-
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
-        logging.info("New client connected")
-
-    def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
-        logging.info("Client disconnected")
-
-    async def send_message(self, message: str, websocket: WebSocket):
-        await websocket.send_json({
-            "response": message,
-            "timestamp": str(datetime.now())
-        })
+app = create_app()
 
 manager = ConnectionManager()
 
@@ -49,39 +19,58 @@ async def websocket_endpoint(websocket: WebSocket):
     await manager.connect(websocket)
     try:
         while True:
-            data = await websocket.receive_json()
+            data = await manager.receive_json(websocket)
+            if data.get("type") == "subscribe":
+                # Progress events for an upload job, pushed until it finishes
+                await get_job_manager().subscribe(data.get("job_id"), manager.frame_sender(websocket))
+                continue
             prompt = data.get("prompt", "")
             file_path = data.get("file_path")
 
-            result = send_request(prompt, file_path)
+            # Cancelled if the client disconnects before the answer is ready
+            if data.get("stream"):
+                # Token frames as they are generated, then a `done` frame with timings
+                frames = async_stream_request(prompt, file_path, hide_thinking=data.get("hide_thinking", False),
+                                              priority=INTERACTIVE, on_queued=manager.queue_reporter(websocket),
+                                              session=manager.session(websocket))
+                await manager.run(websocket, manager.stream(websocket, frames))
+                continue
+            result = await manager.run(websocket, async_send_request(
+                prompt, file_path, priority=INTERACTIVE, on_queued=manager.queue_reporter(websocket),
+                session=manager.session(websocket)))
             await manager.send_message(result, websocket)
 
     except WebSocketDisconnect:
+        get_job_manager().unsubscribe(manager.frame_sender(websocket))
         manager.disconnect(websocket)
     except Exception as e:
         logging.error(f"Error: {str(e)}")
         await manager.send_message(f"Error: {str(e)}", websocket)
 
 @app.post("/upload")
-async def upload_file(file: UploadFile = File(...), prompt: str = Form(...)):
-    try:
-        file_path = os.path.join(UPLOAD_DIR, file.filename)
-        with open(file_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
+async def upload_file(request: Request):
+    """Store the upload and queue it for ingestion; progress is sent to WebSocket subscribers.
 
-        result = send_request(prompt, file_path)
-        
-        # Clean up
-        os.remove(file_path)
-
-        return {
-            "response": result,
-            "timestamp": str(datetime.now())
-        }
+    Multipart form with a `file` and the `prompt` to answer about it.
+    """
+    try:
+        file_path, document_id, size, filename, fields = await receive_upload(request)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         logging.error(f"Error processing upload: {str(e)}")
         return {"error": str(e)}
+    if "prompt" not in fields:
+        raise HTTPException(status_code=422, detail="Missing form field 'prompt'")
+
+    job = get_job_manager().submit(file_path, document_id, filename, fields["prompt"])
+    return {
+        "job_id": job.id,
+        "document_id": document_id,
+        "file_path": file_path,
+        "status": job.status,
+        "timestamp": str(datetime.now())
+    }
 
 if __name__ == "__main__":
     import uvicorn
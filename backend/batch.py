@@ -0,0 +1,367 @@
+"""Answer a JSONL file of questions in bulk, from the command line or POST /batch.
+
+Each input line is a JSON object with a "prompt" and an optional "file_path";
+other fields (an "id", labels) are copied to the output. Records are grouped
+by document so each document is ingested once, and a document is ingested
+while the questions about the previous one are being answered. Questions go
+through the generation scheduler at BULK priority, a bounded number at a time,
+so interactive users keep their place in the queue.
+
+Results are appended to the output JSONL as they finish (not in input order),
+one line per record with "response", "error" and "latency_ms" added. The
+output is also the checkpoint: re-running with the same output skips records
+already answered and retries the ones that failed. Progress, throughput and
+latency percentiles are kept in <output>.checkpoint.json while the run goes.
+
+Usage:
+    python batch.py questions.jsonl -o answers.jsonl --concurrency 8
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import sys
+import time
+from main import BUSY_MESSAGE, UNSUPPORTED_MESSAGE, API_ERROR_MESSAGE
+from ollama_client import close_ollama_client
+from uploads import ingest_upload, answer_upload
+from vector_store import FileLock
+from workers import get_process_pool, run_blocking
+
+# Batch settings (override through the environment)
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", "4"))
+# Records between fsyncs of the output and rewrites of the checkpoint file
+BATCH_CHECKPOINT_EVERY = int(os.environ.get("BATCH_CHECKPOINT_EVERY", "20"))
+# Times a question the scheduler turned away is retried before it is recorded as failed
+BATCH_BUSY_RETRIES = int(os.environ.get("BATCH_BUSY_RETRIES", "5"))
+# Inputs and results of batches submitted over HTTP; kept until deleted
+BATCH_DIR = os.environ.get("BATCH_DIR", "batches")
+
+FAILURE_MESSAGES = (BUSY_MESSAGE, UNSUPPORTED_MESSAGE, API_ERROR_MESSAGE)
+
+class BatchLocked(Exception):
+    """Raised when another process is already running a batch into the same output."""
+
+def percentile(values, q):
+    """Nearest-rank percentile of an already sorted list; None when it is empty."""
+    if not values:
+        return None
+    # q * n / 100 rather than q / 100 * n: exact for integer q, so ranks are not rounded up
+    return values[max(0, math.ceil(q * len(values) / 100) - 1)]
+
+def read_records(path, prompt_field="prompt"):
+    """Return (id, record, error) for every non-blank input line.
+
+    The id is the record's "id", or its line number. error is set for lines
+    that cannot be asked (bad JSON, no prompt); those are reported, not retried.
+    """
+    records, seen = [], set()
+    with open(path, "r", encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            error = None
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+            if not isinstance(record, dict):
+                record, error = {}, f"Line {number} is not a JSON object"
+            elif not isinstance(record.get(prompt_field), str) or not record[prompt_field].strip():
+                error = f"Line {number} has no {prompt_field!r}"
+            record_id = str(record.get("id", number))
+            if record_id in seen:
+                record_id = f"{record_id}@{number}"
+            seen.add(record_id)
+            records.append((record_id, record, error))
+    return records
+
+def read_answered(path):
+    """Ids already answered in an output file, after cutting off a line torn by a crash."""
+    if not os.path.exists(path):
+        return set()
+    with open(path, "rb+") as f:
+        data = f.read()
+        if data and not data.endswith(b"\n"):
+            f.truncate(data.rfind(b"\n") + 1)
+            data = data[:data.rfind(b"\n") + 1]
+    answered = set()
+    for line in data.decode("utf-8", errors="replace").splitlines():
+        try:
+            result = json.loads(line)
+        except ValueError:
+            continue
+        if isinstance(result, dict) and result.get("error") is None:
+            answered.add(str(result.get("id")))
+    return answered
+
+def compact_output(path):
+    """Keep only the last line per id, once retries have appended a second one."""
+    latest = {}
+    with open(path, "r", encoding="utf-8") as f:
+        lines = f.readlines()
+    for line in lines:
+        try:
+            latest[str(json.loads(line).get("id"))] = line
+        except (ValueError, AttributeError):
+            continue
+    if len(latest) == len(lines):
+        return
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.writelines(latest.values())
+    os.replace(tmp_path, path)
+
+async def answer_record(prompt, file_path):
+    """(response, error) for one question; busy rejections are retried with backoff."""
+    for attempt in range(BATCH_BUSY_RETRIES + 1):
+        response = await answer_upload(prompt, file_path)
+        if response != BUSY_MESSAGE:
+            break
+        await asyncio.sleep(min(30, 2 ** attempt))
+    if response in FAILURE_MESSAGES:
+        return None, response
+    return response, None
+
+class BatchRun:
+    """One pass over an input JSONL into an output JSONL.
+
+    `ingest(file_path)` runs in a worker thread once per document and
+    `answer(prompt, file_path)` is awaited for every question, returning
+    (response, error). start() takes the output's lock and works out what is
+    left to do; run() does it. The lock is held until run() returns.
+    """
+
+    def __init__(self, input_path, output_path, concurrency=BATCH_CONCURRENCY, prompt_field="prompt",
+                 checkpoint_every=BATCH_CHECKPOINT_EVERY, ingest=ingest_upload, answer=answer_record):
+        self.input_path = input_path
+        self.output_path = output_path
+        self.checkpoint_path = output_path + ".checkpoint.json"
+        self.concurrency = max(1, concurrency)
+        self.prompt_field = prompt_field
+        self.checkpoint_every = max(1, checkpoint_every)
+        self.ingest = ingest
+        self.answer = answer
+        self.status = "pending"  # pending, running, done, failed or interrupted
+        self.total = self.answered = self.failed = self.skipped = 0
+        self.latencies = []
+        self.started = None
+        self._groups = {}
+        self._lock = None
+        self._output = None
+        self._unsynced = 0
+
+    def start(self):
+        """Lock the output and load the input; raises BatchLocked if another run holds it."""
+        lock = FileLock(self.output_path + ".lock", blocking=False)
+        try:
+            lock.__enter__()
+        except BlockingIOError:
+            raise BatchLocked(f"{self.output_path} is being written by another batch run")
+        self._lock = lock
+        try:
+            answered = read_answered(self.output_path)
+            for record_id, record, error in read_records(self.input_path, self.prompt_field):
+                self.total += 1
+                if record_id in answered:
+                    self.skipped += 1
+                    continue
+                # Records without a document form their own group; dicts keep first-seen order
+                self._groups.setdefault(record.get("file_path") or None, []).append((record_id, record, error))
+            self.answered = self.skipped
+            self._output = open(self.output_path, "a", encoding="utf-8")
+            self.status = "running"
+            self.started = time.time()
+            self.write_checkpoint()
+        except BaseException:
+            self._release()
+            raise
+
+    async def run(self):
+        """Answer every pending record; returns the final report."""
+        try:
+            queue = asyncio.Queue(maxsize=self.concurrency * 2)
+            workers = [asyncio.create_task(self._work(queue)) for _ in range(self.concurrency)]
+            try:
+                await self._produce(queue)
+                for _ in workers:
+                    await queue.put(None)
+                await asyncio.gather(*workers)
+            except BaseException:
+                for worker in workers:
+                    worker.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+                raise
+            self.status = "done"
+        except asyncio.CancelledError:
+            self.status = "interrupted"
+            raise
+        except Exception as e:
+            logging.error(f"Batch {self.input_path} failed: {e}")
+            self.status = "failed"
+        finally:
+            self._output.flush()
+            os.fsync(self._output.fileno())
+            self._output.close()
+            if self.status == "done":
+                compact_output(self.output_path)
+            self.write_checkpoint()
+            self._release()
+        return self.report()
+
+    async def _produce(self, queue):
+        # The bounded queue keeps ingestion about one document ahead of the answers, so
+        # a long batch does not fill the vector store with documents it only asks about later
+        for file_path, records in self._groups.items():
+            error = None
+            if file_path is not None and any(record_error is None for _, _, record_error in records):
+                try:
+                    await asyncio.to_thread(self.ingest, file_path)
+                except Exception as e:
+                    logging.error(f"Batch could not ingest {file_path}: {e}")
+                    error = f"Could not ingest {file_path}: {e}"
+            for record_id, record, record_error in records:
+                await queue.put((record_id, record, record_error or error))
+
+    async def _work(self, queue):
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            record_id, record, error = item
+            response = latency_ms = None
+            if error is None:
+                start = time.perf_counter()
+                try:
+                    response, error = await self.answer(record[self.prompt_field], record.get("file_path"))
+                except Exception as e:
+                    error = str(e)
+                latency_ms = round((time.perf_counter() - start) * 1000, 1)
+                self.latencies.append(latency_ms)
+            self._write(dict(record, id=record_id, response=response,
+                             error=error, latency_ms=latency_ms))
+            if error is None:
+                self.answered += 1
+            else:
+                self.failed += 1
+            self._unsynced += 1
+            if self._unsynced >= self.checkpoint_every:
+                self._unsynced = 0
+                await run_blocking(self._sync)
+
+    def _write(self, result):
+        # One write per line from the event loop thread, so lines never interleave
+        self._output.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+    def _sync(self):
+        self._output.flush()
+        os.fsync(self._output.fileno())
+        self.write_checkpoint()
+
+    def _release(self):
+        if self._lock is not None:
+            self._lock.__exit__(None, None, None)
+            self._lock = None
+
+    def report(self):
+        elapsed = time.time() - self.started if self.started else 0.0
+        done_now = self.answered + self.failed - self.skipped
+        latencies = sorted(self.latencies)
+        return {
+            "input": self.input_path, "output": self.output_path, "status": self.status,
+            "total": self.total, "answered": self.answered, "failed": self.failed, "skipped": self.skipped,
+            "remaining": self.total - self.answered - self.failed,
+            "elapsed_s": round(elapsed, 2),
+            "records_per_s": round(done_now / elapsed, 3) if elapsed else None,
+            "latency_ms": {"p50": percentile(latencies, 50), "p90": percentile(latencies, 90),
+                           "p99": percentile(latencies, 99), "max": latencies[-1] if latencies else None},
+            "updated": time.time(),
+        }
+
+    def write_checkpoint(self):
+        tmp_path = f"{self.checkpoint_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.report(), f)
+            os.replace(tmp_path, self.checkpoint_path)
+        except OSError as e:
+            logging.error(f"Could not write batch checkpoint {self.checkpoint_path}: {e}")
+
+def read_checkpoint(output_path):
+    """The last report written for an output file, or None."""
+    try:
+        with open(output_path + ".checkpoint.json", "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+_running = {}  # output path -> task, for batches started by this server worker
+
+async def start_batch(input_path, output_path, concurrency=BATCH_CONCURRENCY):
+    """Run a batch in the background unless one is already writing output_path.
+
+    Returns the batch's current report.
+    """
+    task = _running.get(output_path)
+    if task is None or task.done():
+        run = BatchRun(input_path, output_path, concurrency)
+        try:
+            await run_blocking(run.start)
+        except BatchLocked:
+            # Another server worker picked it up first
+            return read_checkpoint(output_path)
+        task = asyncio.create_task(run.run())
+        _running[output_path] = task
+        task.add_done_callback(lambda _: _running.pop(output_path, None))
+    return read_checkpoint(output_path)
+
+async def close_batches():
+    """Stop this worker's batches; a later start resumes them from their output."""
+    tasks = list(_running.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+def print_report(report):
+    latency = report["latency_ms"]
+    print(f"{report['status']}: {report['answered']} answered, {report['failed']} failed, "
+          f"{report['skipped']} already done, {report['remaining']} left of {report['total']}")
+    print(f"{report['elapsed_s']} s, {report['records_per_s']} records/s")
+    print(f"latency ms: p50 {latency['p50']}  p90 {latency['p90']}  p99 {latency['p99']}  max {latency['max']}")
+    print(f"results: {report['output']}")
+
+async def run_batch(args):
+    run = BatchRun(args.input, args.output, args.concurrency, args.prompt_field, args.checkpoint_every)
+    try:
+        run.start()
+        return await run.run()
+    finally:
+        await close_ollama_client()
+        get_process_pool().close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="JSONL file of {\"prompt\": ..., \"file_path\": ...} records")
+    parser.add_argument("-o", "--output", help="Results JSONL (default: <input>.results.jsonl)")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY, help="Questions in flight at once")
+    parser.add_argument("--prompt-field", default="prompt", help="Record field holding the question")
+    parser.add_argument("--checkpoint-every", type=int, default=BATCH_CHECKPOINT_EVERY)
+    args = parser.parse_args()
+    args.output = args.output or os.path.splitext(args.input)[0] + ".results.jsonl"
+
+    logging.basicConfig(level=logging.INFO)
+    try:
+        report = asyncio.run(run_batch(args))
+    except BatchLocked as e:
+        print(e, file=sys.stderr)
+        sys.exit(2)
+    except KeyboardInterrupt:
+        print("Interrupted; run again with the same output to resume", file=sys.stderr)
+        sys.exit(130)
+    print_report(report)
+    sys.exit(0 if report["status"] == "done" and not report["failed"] else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Recall and latency of IVF/HNSW indexes against a flat (exact) baseline.
+
+Usage:
+    python bench_index.py                       # synthetic clustered vectors
+    python bench_index.py --vectors emb.npy     # real embeddings saved with np.save
+"""
+import argparse
+import time
+import numpy as np
+from vector_index import build_index, search_index, normalize_vectors
+
+def synthetic_vectors(num_vectors, dimension, num_clusters=256, seed=0):
+    """Clustered random vectors, closer to sentence embeddings than uniform noise."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(num_clusters, dimension))
+    labels = rng.integers(num_clusters, size=num_vectors)
+    return (centers[labels] + 0.3 * rng.normal(size=(num_vectors, dimension))).astype(np.float32)
+
+def timed_search(index, queries, top_k, **params):
+    start = time.perf_counter()
+    _, indices = search_index(index, queries, top_k, **params)
+    return indices, (time.perf_counter() - start) * 1000 / len(queries)
+
+def recall(indices, truth):
+    """Fraction of the exact top-k neighbours that the ANN search returned."""
+    hits = sum(len(set(row) & set(exact)) for row, exact in zip(indices, truth))
+    return hits / truth.size
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", help="Path to a .npy file of embeddings")
+    parser.add_argument("--num-vectors", type=int, default=200000)
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--num-queries", type=int, default=500)
+    parser.add_argument("--top-k", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.vectors:
+        vectors = np.load(args.vectors).astype(np.float32)
+    else:
+        vectors = synthetic_vectors(args.num_vectors, args.dimension)
+    rng = np.random.default_rng(1)
+    queries = vectors[rng.choice(len(vectors), args.num_queries, replace=False)]
+    queries = normalize_vectors(queries + 0.05 * rng.normal(size=queries.shape).astype(np.float32))
+    print(f"{len(vectors)} vectors, dimension {vectors.shape[1]}, {len(queries)} queries, top_k={args.top_k}")
+
+    start = time.perf_counter()
+    flat = build_index(vectors, "flat")
+    print(f"flat: built in {time.perf_counter() - start:.1f}s")
+    truth, flat_ms = timed_search(flat, queries, args.top_k)
+    print(f"{'index':<8}{'param':<14}{'recall':>8}{'ms/query':>10}")
+    print(f"{'flat':<8}{'-':<14}{1.0:>8.3f}{flat_ms:>10.3f}")
+
+    for kind, param_name, values in (("ivf", "nprobe", (1, 4, 16, 64)), ("hnsw", "ef_search", (16, 32, 64, 128))):
+        start = time.perf_counter()
+        index = build_index(vectors, kind)
+        print(f"{kind}: built in {time.perf_counter() - start:.1f}s")
+        for value in values:
+            indices, ms = timed_search(index, queries, args.top_k, **{param_name: value})
+            print(f"{kind:<8}{f'{param_name}={value}':<14}{recall(indices, truth):>8.3f}{ms:>10.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""Throughput of native DOCX/PPTX extraction against Office-to-PDF conversion.
+
+Usage:
+    python bench_office.py report.docx slides.pptx [--repeat 5]
+
+The conversion path (convert_to_pdf + process_pdf) needs Windows with Microsoft
+Office; elsewhere it is reported as unavailable. XLSX workbooks are read as tables
+(tabular.iter_xlsx_rows), not extracted as documents, so they are not compared here.
+"""
+import argparse
+import os
+import time
+from main import convert_to_pdf, process_office_file, process_pdf
+
+def run(label, extract, paths, repeat):
+    """Time extract over every file; returns None if it failed."""
+    total_bytes = sum(os.path.getsize(path) for path in paths) * repeat
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for path in paths:
+            if extract(path) is None:
+                print(f"{label:<12} unavailable ({os.path.basename(path)} failed)")
+                return None
+    seconds = time.perf_counter() - start
+    files = len(paths) * repeat
+    print(f"{label:<12}{files / seconds:>10.2f} files/s{total_bytes / seconds / 1024 ** 2:>10.2f} MB/s{seconds * 1000 / files:>10.1f} ms/file")
+    return seconds
+
+def via_pdf(path):
+    pdf_path = convert_to_pdf(os.path.abspath(path))
+    return process_pdf(pdf_path) if pdf_path else None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="+", help="DOCX or PPTX files")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    native = run("native", process_office_file, args.files, args.repeat)
+    converted = run("via PDF", via_pdf, args.files, args.repeat)
+    if native and converted:
+        print(f"native extraction is {converted / native:.1f}x faster")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Cold import time of the server modules, which is what every reload pays.
+
+Each module is imported in fresh interpreters and the median wall time is
+reported, along with the slowest imports underneath it and any heavy library
+that was loaded eagerly (those belong behind a lazy import or in the lifespan
+preload). Exits non-zero when a module is over budget or loads a heavy library.
+
+Usage:
+    python bench_startup.py                          # websock, back and main
+    python bench_startup.py back --runs 10 --budget 1.5
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+# Libraries that must only load on first use or in the lifespan preload
+HEAVY_MODULES = ["torch", "sentence_transformers", "faiss", "pandas", "fitz", "pymupdf", "nltk",
+                 "docx", "pptx", "openpyxl", "pytesseract", "PIL", "pdf2image", "comtypes"]
+
+PROBE = """
+import sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(elapsed, ",".join(name for name in {heavy!r} if name in sys.modules))
+"""
+
+def time_import(module, runs):
+    """Median seconds to import module cold, and the heavy libraries it loaded."""
+    times, loaded = [], set()
+    here = os.path.dirname(os.path.abspath(__file__))
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", PROBE.format(module=module, heavy=HEAVY_MODULES)],
+            cwd=here, capture_output=True, text=True, check=True,
+        ).stdout.splitlines()[-1].split(" ")
+        times.append(float(output[0]))
+        loaded.update(name for name in output[1].split(",") if name)
+    return statistics.median(times), max(times), sorted(loaded)
+
+def slowest_imports(module, count):
+    """(cumulative ms, name) of the slowest imports under module, from -X importtime."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=here, capture_output=True, text=True, check=True,
+    ).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if name.strip() != module:
+            rows.append((int(cumulative) / 1000, name.rstrip()))
+    return sorted(rows, reverse=True)[:count]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("modules", nargs="*", default=["websock", "back", "main"])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=2.0, help="Seconds allowed per module import")
+    parser.add_argument("--top", type=int, default=8, help="Slowest imports to list per module")
+    args = parser.parse_args()
+
+    failed = False
+    print(f"{'module':<12}{'median s':>10}{'max s':>10}  eager heavy imports")
+    for module in args.modules:
+        median, worst, loaded = time_import(module, args.runs)
+        over = median > args.budget
+        failed |= over or bool(loaded)
+        flag = "  OVER BUDGET" if over else ""
+        print(f"{module:<12}{median:>10.2f}{worst:>10.2f}  {', '.join(loaded) or '-'}{flag}")
+        for ms, name in slowest_imports(module, args.top):
+            print(f"{'':<14}{ms:>8.0f} ms {name}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
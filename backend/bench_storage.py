@@ -0,0 +1,52 @@
+"""Memory per million chunks and recall of compressed index storage against float32.
+
+Usage:
+    python bench_storage.py                       # synthetic clustered vectors
+    python bench_storage.py --vectors emb.npy     # real embeddings saved with np.save
+    python bench_storage.py --index-type ivf      # compare storage modes inside IVF
+"""
+import argparse
+import time
+import faiss
+import numpy as np
+from bench_index import synthetic_vectors, timed_search, recall
+from vector_index import build_index, normalize_vectors
+
+STORAGE_MODES = ("float32", "float16", "int8", "pq")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", help="Path to a .npy file of embeddings")
+    parser.add_argument("--num-vectors", type=int, default=100000)
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--num-queries", type=int, default=500)
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--index-type", default="flat", choices=("flat", "ivf", "hnsw"))
+    args = parser.parse_args()
+
+    if args.vectors:
+        vectors = np.load(args.vectors).astype(np.float32)
+    else:
+        vectors = synthetic_vectors(args.num_vectors, args.dimension)
+    rng = np.random.default_rng(1)
+    queries = vectors[rng.choice(len(vectors), args.num_queries, replace=False)]
+    queries = normalize_vectors(queries + 0.05 * rng.normal(size=queries.shape).astype(np.float32))
+    print(f"{len(vectors)} vectors, dimension {vectors.shape[1]}, {args.index_type} index, top_k={args.top_k}")
+
+    # Exact float32 neighbours are the recall reference for every mode
+    truth, _ = timed_search(build_index(vectors, "flat", "float32"), queries, args.top_k)
+
+    print(f"{'storage':<10}{'bytes/vec':>10}{'MB/1M chunks':>14}{'recall':>8}{'ms/query':>10}{'build s':>9}")
+    for storage in STORAGE_MODES:
+        start = time.perf_counter()
+        index = build_index(vectors, args.index_type, storage)
+        build_seconds = time.perf_counter() - start
+        bytes_per_vector = faiss.serialize_index(index).nbytes / index.ntotal
+        indices, ms = timed_search(index, queries, args.top_k)
+        print(
+            f"{storage:<10}{bytes_per_vector:>10.1f}{bytes_per_vector * 1e6 / 1024 ** 2:>14.0f}"
+            f"{recall(indices, truth):>8.3f}{ms:>10.3f}{build_seconds:>9.1f}"
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import logging
+import os
+import re
+import threading
+
+# Chunk window settings (override through the environment). all-MiniLM-L6-v2 truncates
+# inputs at 256 word pieces, so windows stay a little below that.
+CHUNK_MAX_TOKENS = int(os.environ.get("CHUNK_MAX_TOKENS", "180"))
+CHUNK_OVERLAP_TOKENS = int(os.environ.get("CHUNK_OVERLAP_TOKENS", "30"))
+
+# Pages are separated by form feeds in extracted text
+PAGE_BREAK = "\f"
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+_tokenizer_ready = False
+_tokenizer_lock = threading.Lock()
+
+def ensure_sentence_tokenizer():
+    """Import nltk and fetch the punkt data if missing; done once, on first use or at server startup."""
+    global _tokenizer_ready
+    with _tokenizer_lock:
+        if _tokenizer_ready:
+            return
+        import nltk
+        try:
+            nltk.data.find('tokenizers/punkt')
+        except LookupError:
+            logging.info("Downloading NLTK 'punkt' tokenizer...")
+            nltk.download('punkt')
+        _tokenizer_ready = True
+
+def count_tokens(text):
+    """Approximate token count: words and punctuation marks."""
+    return len(_TOKEN_RE.findall(text))
+
+def chunker_settings():
+    """Settings that change chunk boundaries; part of the vector store key."""
+    return {
+        "method": "token_window",
+        "max_tokens": CHUNK_MAX_TOKENS,
+        "overlap_tokens": CHUNK_OVERLAP_TOKENS,
+        "table_rows": "column=value, split at max_tokens",
+    }
+
+class Chunk:
+    """A window of text with its character offsets in the document and its page number."""
+
+    __slots__ = ("text", "start", "end", "page")
+
+    def __init__(self, text, start, end, page):
+        self.text = text
+        self.start = start
+        self.end = end
+        self.page = page
+
+    def __repr__(self):
+        return f"Chunk(page={self.page}, start={self.start}, end={self.end}, text={self.text[:40]!r})"
+
+def split_pages(text):
+    """Turn extracted text into (page_number, page_text) records."""
+    for number, page_text in enumerate(text.split(PAGE_BREAK), start=1):
+        yield number, page_text
+
+def _sentence_spans(text):
+    """Yield (sentence, start, end) with character offsets into text."""
+    try:
+        ensure_sentence_tokenizer()
+        import nltk
+        sentences = nltk.sent_tokenize(text)
+    except Exception as e:
+        logging.error(f"Error splitting sentences: {e}")
+        sentences = [text]
+    cursor = 0
+    for sentence in sentences:
+        start = text.find(sentence, cursor)
+        if start < 0:
+            start = cursor
+        end = start + len(sentence)
+        cursor = end
+        yield sentence, start, end
+
+def split_long_text(sentence, start, max_tokens):
+    """Split text longer than the window at token boundaries; (piece, start, end) records."""
+    matches = list(_TOKEN_RE.finditer(sentence))
+    for i in range(0, len(matches), max_tokens):
+        piece = matches[i:i + max_tokens]
+        piece_start, piece_end = piece[0].start(), piece[-1].end()
+        yield sentence[piece_start:piece_end], start + piece_start, start + piece_end
+
+def iter_chunks(pages, max_tokens=CHUNK_MAX_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS, token_counter=count_tokens):
+    """Stream token-window chunks from (page_number, text) records.
+
+    Sentences are packed into windows of at most max_tokens; consecutive windows
+    share up to overlap_tokens of trailing sentences. Only the current window is
+    held in memory, so pages can come straight from the extractor.
+    """
+    window = []  # (text, start, end, page, tokens)
+    window_tokens = 0
+    base = 0
+
+    def emit():
+        return Chunk(" ".join(s[0] for s in window), window[0][1], window[-1][2], window[0][3])
+
+    for page, page_text in pages:
+        for sentence, start, end in _sentence_spans(page_text):
+            tokens = token_counter(sentence)
+            if tokens == 0:
+                continue
+            if tokens > max_tokens:
+                pieces = [(text, s, e, token_counter(text)) for text, s, e in split_long_text(sentence, start, max_tokens)]
+            else:
+                pieces = [(sentence, start, end, tokens)]
+
+            for text, s, e, piece_tokens in pieces:
+                if window and window_tokens + piece_tokens > max_tokens:
+                    yield emit()
+                    # Carry trailing sentences into the next window as overlap
+                    carried = []
+                    carried_tokens = 0
+                    for item in reversed(window):
+                        if carried_tokens + item[4] > overlap_tokens or carried_tokens + item[4] + piece_tokens > max_tokens:
+                            break
+                        carried.insert(0, item)
+                        carried_tokens += item[4]
+                    window, window_tokens = carried, carried_tokens
+                window.append((text, base + s, base + e, page, piece_tokens))
+                window_tokens += piece_tokens
+        base += len(page_text) + len(PAGE_BREAK)
+
+    if window:
+        yield emit()
@@ -0,0 +1,129 @@
+import asyncio
+import json
+import logging
+from datetime import datetime
+from fastapi import WebSocket, WebSocketDisconnect
+from sessions import get_session_store
+
+class ConnectionManager:
+    """Tracks WebSocket clients and notices disconnects while a reply is being generated.
+
+    Each connection gets a reader task that queues incoming messages, so a
+    disconnect is seen even while the handler is busy awaiting Ollama, and a
+    conversation session that lives as long as the connection.
+    """
+
+    def __init__(self, json_messages=True):
+        self.json_messages = json_messages
+        self.active_connections: list[WebSocket] = []
+        self._inbox = {}  # websocket -> asyncio.Queue of message text, None once closed
+        self._readers = {}
+        self._session_ids = {}
+        self._senders = {}
+
+    async def connect(self, websocket: WebSocket):
+        await websocket.accept()
+        self.active_connections.append(websocket)
+        self._inbox[websocket] = asyncio.Queue()
+        self._readers[websocket] = asyncio.create_task(self._read(websocket))
+        self._session_ids[websocket] = get_session_store().get().id
+        logging.info("New client connected")
+
+    def disconnect(self, websocket: WebSocket):
+        if websocket in self.active_connections:
+            self.active_connections.remove(websocket)
+        self._inbox.pop(websocket, None)
+        reader = self._readers.pop(websocket, None)
+        if reader:
+            reader.cancel()
+        self._senders.pop(websocket, None)
+        session_id = self._session_ids.pop(websocket, None)
+        if session_id:
+            get_session_store().drop(session_id)
+        logging.info("Client disconnected")
+
+    def session(self, websocket: WebSocket):
+        """The connection's conversation session (a fresh one if it was evicted while idle)."""
+        return get_session_store().get(self._session_ids.get(websocket))
+
+    async def _read(self, websocket):
+        inbox = self._inbox[websocket]
+        try:
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                text = message.get("text")
+                if text is None and message.get("bytes") is not None:
+                    text = message["bytes"].decode("utf-8")
+                if text is not None:
+                    await inbox.put(text)
+        except Exception as e:
+            logging.error(f"Error reading from client: {e}")
+        finally:
+            inbox.put_nowait(None)
+
+    async def receive_text(self, websocket: WebSocket):
+        """Next message from the client; raises WebSocketDisconnect once it has gone."""
+        inbox = self._inbox.get(websocket)
+        text = await inbox.get() if inbox else None
+        if text is None:
+            if inbox:
+                inbox.put_nowait(None)  # later receives see the disconnect too
+            raise WebSocketDisconnect()
+        return text
+
+    async def receive_json(self, websocket: WebSocket):
+        return json.loads(await self.receive_text(websocket))
+
+    async def run(self, websocket: WebSocket, coro):
+        """Await coro, cancelling it if the client disconnects first."""
+        task = asyncio.ensure_future(coro)
+        reader = self._readers.get(websocket)
+        if reader is None:
+            task.cancel()
+            raise WebSocketDisconnect()
+        await asyncio.wait({task, reader}, return_when=asyncio.FIRST_COMPLETED)
+        if not task.done():
+            task.cancel()
+            logging.info("Client disconnected; cancelled its generation")
+            raise WebSocketDisconnect()
+        return task.result()
+
+    async def send_message(self, message: str, websocket: WebSocket):
+        try:
+            if self.json_messages:
+                await websocket.send_json({
+                    "response": message,
+                    "timestamp": str(datetime.now())
+                })
+            else:
+                await websocket.send_text(message)
+            logging.info(f"Message sent: {message[:100]}...")
+        except Exception as e:
+            logging.error(f"Error sending message: {e}")
+
+    async def send_frame(self, frame, websocket: WebSocket):
+        """Send one streaming frame as JSON, stamped with the time it left."""
+        await websocket.send_json(dict(frame, timestamp=str(datetime.now())))
+
+    def frame_sender(self, websocket: WebSocket):
+        """send_frame bound to one connection; the same callable every time, so it can be unsubscribed."""
+        sender = self._senders.get(websocket)
+        if sender is None:
+            async def sender(frame):
+                await self.send_frame(frame, websocket)
+            self._senders[websocket] = sender
+        return sender
+
+    def queue_reporter(self, websocket: WebSocket):
+        """Scheduler callback that tells the client where it is in the generation queue."""
+        async def report(position, estimated_wait):
+            await self.send_frame({"type": "queued", "position": position,
+                                   "estimated_wait_s": round(estimated_wait, 1)}, websocket)
+        return report
+
+    async def stream(self, websocket: WebSocket, frames):
+        """Forward every frame of an async iterator to the client as it arrives."""
+        async for frame in frames:
+            await self.send_frame(frame, websocket)
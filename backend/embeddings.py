@@ -0,0 +1,164 @@
+import logging
+import os
+import itertools
+import queue
+import threading
+import time
+from concurrent.futures import Future
+import numpy as np
+
+# Embedding model settings (override through the environment)
+EMBEDDING_MODEL_NAME = os.environ.get("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+EMBEDDING_DEVICE = os.environ.get("EMBEDDING_DEVICE", "cpu")
+EMBEDDING_THREADS = int(os.environ.get("EMBEDDING_THREADS", "0"))  # 0 = library default
+EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", "64"))
+EMBEDDING_MAX_WAIT_MS = float(os.environ.get("EMBEDDING_MAX_WAIT_MS", "5"))
+# Seconds encode() waits for its batch before giving up
+EMBEDDING_TIMEOUT = float(os.environ.get("EMBEDDING_TIMEOUT", "60"))
+
+# Encoding priorities: queries jump ahead of document batches from ingestion
+QUERY_PRIORITY = 0
+INGEST_PRIORITY = 1
+_CLOSE = float("inf")
+
+# Loaded models, keyed by (model name, device)
+_models = {}
+_models_lock = threading.Lock()
+
+def _load_model(model_name, device):
+    """Load a SentenceTransformer and run a warmup encode."""
+    if EMBEDDING_THREADS > 0:
+        import torch
+        torch.set_num_threads(EMBEDDING_THREADS)
+
+    start = time.perf_counter()
+    from sentence_transformers import SentenceTransformer  # pulls in torch; only when a model is needed
+    model = SentenceTransformer(model_name, device=device)
+    loaded = time.perf_counter()
+    # The first encode pays for lazy kernel/tokenizer setup; do it here, not in a request
+    model.encode(["warmup"])
+    logging.info(
+        f"Embedding model '{model_name}' on {device} loaded in {loaded - start:.2f}s "
+        f"(warmup {time.perf_counter() - loaded:.2f}s)"
+    )
+    return model
+
+def get_embedding_model(model_name=None, device=None):
+    """Return the shared embedding model, loading it on first use."""
+    key = (model_name or EMBEDDING_MODEL_NAME, device or EMBEDDING_DEVICE)
+    model = _models.get(key)
+    if model is None:
+        with _models_lock:
+            model = _models.get(key)
+            if model is None:
+                model = _load_model(*key)
+                _models[key] = model
+    return model
+
+class EmbeddingService:
+    """Micro-batching encoder shared by all requests.
+
+    Callers submit lists of texts and get a Future back. A single worker thread
+    owns the torch model: it gathers pending jobs into batches of up to
+    max_batch_size texts, waiting at most max_wait_ms for a batch to fill.
+    Jobs are taken by priority, so a query is not stuck behind the backlog of a
+    large document being ingested.
+    """
+
+    def __init__(self, model=None, max_batch_size=EMBEDDING_BATCH_SIZE, max_wait_ms=EMBEDDING_MAX_WAIT_MS):
+        self.model = model or get_embedding_model()
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._jobs = queue.PriorityQueue()
+        self._order = itertools.count()
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, texts, priority=QUERY_PRIORITY):
+        """Queue texts for encoding; the Future resolves to a float32 array."""
+        future = Future()
+        texts = list(texts)
+        if not texts:
+            future.set_result(np.zeros((0, self.dimension), dtype=np.float32))
+        elif self._closed:
+            future.set_exception(RuntimeError("Embedding service is closed"))
+        else:
+            self._jobs.put((priority, next(self._order), texts, future))
+        return future
+
+    def encode(self, texts, priority=QUERY_PRIORITY, timeout=EMBEDDING_TIMEOUT):
+        """Encode texts and block until the batch containing them is done."""
+        return self.submit(texts, priority).result(timeout)
+
+    @property
+    def dimension(self):
+        return self.model.get_sentence_embedding_dimension()
+
+    def close(self):
+        self._closed = True
+        self._jobs.put((_CLOSE, next(self._order), None, None))
+        self._worker.join()
+
+    def _collect(self, first):
+        """Gather jobs after the first one until the batch is full or max_wait expires."""
+        batch = [first]
+        size = len(first[2])
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                job = self._jobs.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if job[0] == _CLOSE:
+                self._jobs.put(job)
+                break
+            batch.append(job)
+            size += len(job[2])
+        return batch
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            if job[0] == _CLOSE:
+                break
+            batch = [(texts, future) for _, _, texts, future in self._collect(job)
+                     if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            texts = [text for job_texts, _ in batch for text in job_texts]
+            try:
+                vectors = np.asarray(
+                    self.model.encode(texts, batch_size=self.max_batch_size), dtype=np.float32
+                )
+            except Exception as e:
+                logging.error(f"Error encoding batch of {len(texts)} texts: {e}")
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            start = 0
+            for job_texts, future in batch:
+                future.set_result(vectors[start:start + len(job_texts)])
+                start += len(job_texts)
+
+_service = None
+_service_lock = threading.Lock()
+
+def get_embedding_service():
+    """Return the process-wide micro-batching embedding service."""
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = EmbeddingService()
+    return _service
+
+def warmup_embedding_model():
+    """Load the default embedding model ahead of the first request (server startup)."""
+    try:
+        get_embedding_service()
+    except Exception as e:
+        logging.error(f"Error loading embedding model {EMBEDDING_MODEL_NAME}: {e}")
@@ -0,0 +1,155 @@
+import json
+import os
+import re
+from array import array
+import numpy as np
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Reciprocal-rank fusion constant (Cormack et al. use 60)
+RRF_K = 60
+# Skip the dense search when the best BM25 hit beats the runner-up by this factor
+LEXICAL_FASTPATH_RATIO = float(os.environ.get("LEXICAL_FASTPATH_RATIO", "2.0"))
+
+VOCAB_FILE = "lexical_vocab.json"
+ARRAY_FILES = ("postings_offsets", "postings_docs", "postings_freqs", "doc_lengths")
+
+STOP_WORDS = frozenset(
+    "a an and are as at be by can do does for from has have how i in is it its of on or "
+    "that the their there this to was what when where which who why will with you".split()
+)
+
+# Keeps part numbers, error codes and column names such as ERR-1042, v2.3.1 or unit_price whole
+_TERM_RE = re.compile(r"\w+(?:[-./]\w+)*")
+
+def tokenize(text):
+    """Lowercased terms, without stop words, for indexing and querying."""
+    return [term for term in _TERM_RE.findall(text.lower()) if term not in STOP_WORDS]
+
+def is_exact_term(term):
+    """Identifier-like terms (digits, separators) that dense embeddings tend to blur."""
+    return any(c.isdigit() for c in term) or any(c in "-./_" for c in term)
+
+class InvertedIndex:
+    """BM25 inverted index with array-backed (CSR) postings.
+
+    Postings for term t are postings_docs/postings_freqs[offsets[t]:offsets[t + 1]],
+    sorted by document id.
+    """
+
+    def __init__(self, vocab, postings_offsets, postings_docs, postings_freqs, doc_lengths):
+        self.vocab = vocab
+        self.postings_offsets = postings_offsets
+        self.postings_docs = postings_docs
+        self.postings_freqs = postings_freqs
+        self.doc_lengths = doc_lengths
+        self.num_docs = len(doc_lengths)
+        self.avg_doc_length = float(np.mean(doc_lengths)) if self.num_docs else 0.0
+
+    @classmethod
+    def build(cls, documents):
+        """Index an iterable of chunk strings."""
+        builder = InvertedIndexBuilder()
+        for text in documents:
+            builder.add(text)
+        return builder.build()
+
+    def scores(self, query):
+        """BM25 score of every document for the query."""
+        scores = np.zeros(self.num_docs, dtype=np.float32)
+        for term in set(tokenize(query)):
+            term_id = self.vocab.get(term)
+            if term_id is None:
+                continue
+            start, end = self.postings_offsets[term_id], self.postings_offsets[term_id + 1]
+            docs = self.postings_docs[start:end]
+            tf = self.postings_freqs[start:end].astype(np.float32)
+            idf = np.log(1.0 + (self.num_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            norm = BM25_K1 * (1.0 - BM25_B + BM25_B * self.doc_lengths[docs] / max(self.avg_doc_length, 1.0))
+            scores[docs] += idf * tf * (BM25_K1 + 1.0) / (tf + norm)
+        return scores
+
+    def search(self, query, top_k):
+        """Return (scores, doc_ids) of the top_k documents with a positive score."""
+        scores = self.scores(query)
+        top_k = min(top_k, self.num_docs)
+        if top_k == 0:
+            return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64)
+        candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+        candidates = candidates[np.argsort(-scores[candidates])]
+        candidates = candidates[scores[candidates] > 0]
+        return scores[candidates], candidates
+
+    def is_decisive(self, query, scores):
+        """Whether lexical hits alone can answer the query (the fast path).
+
+        True when the query names an identifier-like term that the index knows and the
+        best hit outscores the runner-up by LEXICAL_FASTPATH_RATIO.
+        """
+        if len(scores) == 0 or not any(is_exact_term(t) and t in self.vocab for t in tokenize(query)):
+            return False
+        return len(scores) == 1 or scores[0] >= LEXICAL_FASTPATH_RATIO * scores[1]
+
+    def save(self, directory):
+        with open(os.path.join(directory, VOCAB_FILE), "w", encoding="utf-8") as f:
+            json.dump(self.vocab, f)
+        for name in ARRAY_FILES:
+            np.save(os.path.join(directory, f"{name}.npy"), getattr(self, name))
+
+    @classmethod
+    def load(cls, directory):
+        """Load a saved index with memory-mapped postings, or None if there is none."""
+        vocab_path = os.path.join(directory, VOCAB_FILE)
+        if not os.path.exists(vocab_path):
+            return None
+        with open(vocab_path, "r", encoding="utf-8") as f:
+            vocab = json.load(f)
+        arrays = [np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r") for name in ARRAY_FILES]
+        return cls(vocab, *arrays)
+
+class InvertedIndexBuilder:
+    """Accumulates postings chunk by chunk, so ingestion can index while it streams."""
+
+    def __init__(self):
+        self.vocab = {}
+        # Compact typed arrays rather than lists of Python ints
+        self._term_ids = array("q")
+        self._doc_ids = array("i")
+        self._freqs = array("i")
+        self._doc_lengths = array("i")
+
+    def add(self, text):
+        """Index the next chunk; chunk ids are assigned in insertion order."""
+        doc_id = len(self._doc_lengths)
+        counts = {}
+        terms = tokenize(text)
+        for term in terms:
+            term_id = self.vocab.setdefault(term, len(self.vocab))
+            counts[term_id] = counts.get(term_id, 0) + 1
+        self._term_ids.extend(counts.keys())
+        self._doc_ids.extend([doc_id] * len(counts))
+        self._freqs.extend(counts.values())
+        self._doc_lengths.append(len(terms))
+
+    def build(self):
+        term_ids = np.frombuffer(self._term_ids, dtype=np.int64) if self._term_ids else np.zeros(0, dtype=np.int64)
+        # Stable sort keeps document ids ascending inside each postings list
+        order = np.argsort(term_ids, kind="stable")
+        offsets = np.zeros(len(self.vocab) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=len(self.vocab)), out=offsets[1:])
+        return InvertedIndex(
+            self.vocab,
+            offsets,
+            np.array(self._doc_ids, dtype=np.int32)[order],
+            np.array(self._freqs, dtype=np.int32)[order],
+            np.array(self._doc_lengths, dtype=np.int32),
+        )
+
+def reciprocal_rank_fusion(rankings, top_k, k=RRF_K):
+    """Fuse ranked lists of document ids; returns the top_k fused ids."""
+    fused = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            fused[int(doc_id)] = fused.get(int(doc_id), 0.0) + 1.0 / (k + rank + 1)
+    return sorted(fused, key=fused.get, reverse=True)[:top_k]
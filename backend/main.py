@@ -1,36 +1,41 @@
 import requests
 import json
 import os
-import fitz  # PyMuPDF for PDF handling
-import pandas as pd  # CSV and XLSX handling
-import pytesseract  # OCR for images and scanned PDFs
-from PIL import Image  # Image processing
-from docx import Document  # DOCX file handling
-from pptx import Presentation  # PPTX file handling
-from openpyxl import load_workbook  # XLSX handling
-import faiss
-import numpy as np
+import time
 import logging
-import nltk
-from sentence_transformers import SentenceTransformer
-from pdf2image import convert_from_path  # Convert PDF pages to images
-import comtypes.client  # Convert PPTX/DOCX/XLSX to PDF (requires MS Office)
+from embeddings import get_embedding_service, EMBEDDING_MODEL_NAME, INGEST_PRIORITY
+from vector_store import get_vector_store, document_key
+from vector_index import build_index, search_index, index_settings
+from chunking import Chunk, iter_chunks, split_pages, chunker_settings, PAGE_BREAK
+from lexical import reciprocal_rank_fusion
+from pdf_extraction import extract_pdf_pages, iter_pdf_pages, ocr_missing_pages, ocr_image, OCR_MIN_TEXT_CHARS, TESSERACT_CMD
+from pipeline import IngestionPipeline
+from workers import get_process_pool, run_blocking
+from office_extraction import OFFICE_EXTRACTORS, extract_office_pages
+from tabular import TABULAR_CATEGORIES, iter_table_rows, iter_row_chunks
+from streaming import ThinkFilter
+from response_cache import get_response_cache, get_coalescer, cache_key, document_hash
+from prompt_packer import (
+    context_budget, estimate_tokens, adaptive_top_k, document_fits, pack_chunks, truncate_to_budget, SMALL_FILE_BYTES,
+)
+from scheduler import get_scheduler, SchedulerBusy, INTERACTIVE
+from sessions import get_session_store, SESSION_MAX_CONTEXT_TOKENS, SESSION_NUM_CTX
+from ollama_client import (
+    get_ollama_client, OllamaError, OLLAMA_URL, OLLAMA_MODEL, OLLAMA_CONNECT_TIMEOUT, OLLAMA_READ_TIMEOUT, OLLAMA_KEEP_ALIVE,
+)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
-# Ensure NLTK data is downloaded
-try:
-    nltk.data.find('tokenizers/punkt')
-except LookupError:
-    logging.info("Downloading NLTK 'punkt' tokenizer...")
-    nltk.download('punkt')
+# API endpoint
+url = f"{OLLAMA_URL}/api/generate"
 
-# Set Tesseract path (update this if needed)
-pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+BUSY_MESSAGE = "The server is busy; please try again shortly."
+UNSUPPORTED_MESSAGE = "Unsupported file type."
+API_ERROR_MESSAGE = "Failed to communicate with the API."
 
-# API endpoint
-url = "http://localhost:11434/api/generate"
+# File types whose text is chunked and indexed for retrieval
+INDEXED_CATEGORIES = ["pdf", "csv", "text", "docx", "pptx", "xlsx"]
 
 def categorize_file(file_path):
     """Determine the file type based on extension."""
@@ -55,8 +60,12 @@ def categorize_file(file_path):
         return "unknown"
 
 def convert_to_pdf(file_path):
-    """Convert PPTX, DOCX, or XLSX files to PDF using comtypes (requires Microsoft Office)."""
+    """Convert PPTX, DOCX, or XLSX files to PDF using comtypes (requires Microsoft Office).
+
+    Only kept for comparison (bench_office.py); process_file extracts these formats natively.
+    """
     try:
+        import comtypes.client  # Windows only
         output_pdf = os.path.splitext(file_path)[0] + ".pdf"
         file_type = categorize_file(file_path)
 
@@ -101,15 +110,10 @@ def process_file(file_path):
         return process_image(file_path)
     elif category == "pdf":
         return process_pdf(file_path)
-    elif category == "csv":
-        df = pd.read_csv(file_path)
-        return df.to_string()
-    elif category == "xlsx":
-        df = pd.read_excel(file_path)
-        return df.to_string()
-    elif category in ["pptx", "docx"]:
-        pdf_path = convert_to_pdf(file_path)
-        return process_pdf(pdf_path) if pdf_path else None
+    elif category in TABULAR_CATEGORIES:
+        return process_table(file_path)
+    elif category in OFFICE_EXTRACTORS:
+        return process_office_file(file_path)
     elif category == "text":
         with open(file_path, "r", encoding="utf-8") as f:
             return f.read()
@@ -117,90 +121,498 @@ def process_file(file_path):
         logging.warning(f"Unsupported file type: {file_path}")
         return None
 
+def process_table(file_path):
+    """Render a CSV or XLSX file as one `column=value` record per row."""
+    try:
+        return "\n".join(record for _, _, record in iter_table_rows(file_path))
+    except Exception as e:
+        logging.error(f"Error processing table {file_path}: {e}")
+        return None
+
+def extract_office_file(file_path):
+    """Yield (page_number, text) records of a DOCX or PPTX, parsed in a worker process.
+
+    Like the extractors it wraps, nothing runs (or fails) until iteration starts.
+    """
+    yield from get_process_pool().run(extract_office_pages, file_path, categorize_file(file_path))
+
+def process_office_file(file_path):
+    """Extract text from a DOCX or PPTX file without converting it."""
+    try:
+        pages = extract_office_file(file_path)
+        return PAGE_BREAK.join(text for _, text in pages)
+    except Exception as e:
+        logging.error(f"Error processing {file_path}: {e}")
+        return None
+
 def process_image(file_path):
     """Extract text from an image using OCR."""
     try:
-        image = Image.open(file_path)
-        text = pytesseract.image_to_string(image)
+        # Decoded and OCR'd in a worker process, so a malformed image cannot crash the server
+        text = get_process_pool().run(ocr_image, file_path, TESSERACT_CMD)
         return text.strip() or "No readable text found in the image."
     except Exception as e:
         logging.error(f"Error processing image {file_path}: {e}")
         return "Image processing failed."
 
-def process_pdf(file_path):
-    """Extract text from a PDF."""
-    text = ""
+def process_pdf_pages(file_path):
+    """Extract (page_number, text) records from a PDF."""
     try:
-        with fitz.open(file_path) as pdf:
-            for page in pdf:
-                text += page.get_text()
-        if not text.strip():
-            logging.info("No text extracted from PDF. Attempting OCR...")
-            images = convert_from_path(file_path)
-            text = " ".join([pytesseract.image_to_string(img) for img in images])
-        return text
+        # Scanned pages yield no text; OCR just those, not the whole document
+        return ocr_missing_pages(file_path, extract_pdf_pages(file_path))
     except Exception as e:
         logging.error(f"Error processing PDF {file_path}: {e}")
         return None
 
+def process_pdf(file_path):
+    """Extract text from a PDF."""
+    pages = process_pdf_pages(file_path)
+    if pages is None:
+        return None
+    return PAGE_BREAK.join(text for _, text in pages)
+
+def iter_file_pages(file_path):
+    """Stream (page_number, text) records from a file, or None if it has no text."""
+    category = categorize_file(file_path)
+    if category == "pdf":
+        return iter_pdf_pages(file_path)
+    if category in OFFICE_EXTRACTORS:
+        return extract_office_file(file_path)
+    text = process_file(file_path)
+    return split_pages(text) if text else None
+
 def chunk_document(text):
-    """Chunk text into sentences for efficient processing."""
+    """Chunk text into token windows that respect sentence boundaries.
+
+    `text` is a string or a list of (page_number, text) records.
+    """
+    pages = list(split_pages(text)) if isinstance(text, str) else text
     try:
-        return nltk.sent_tokenize(text)
+        return list(iter_chunks(pages))
     except Exception as e:
         logging.error(f"Error chunking document: {e}")
-        return [text]
+        text = PAGE_BREAK.join(page_text for _, page_text in pages)
+        return [Chunk(text, 0, len(text), 1)]
+
+def embed_documents(documents):
+    """Encode document chunks into float32 vectors through the shared embedding service."""
+    service = get_embedding_service()
+    return service.encode(documents, INGEST_PRIORITY, timeout=None), service
+
+def build_faiss_index(vectors):
+    """Build a FAISS index over precomputed vectors (flat, IVF or HNSW by corpus size)."""
+    return build_index(vectors)
 
 def create_faiss_index(documents):
     """Create a FAISS index for fast retrieval."""
-    model = SentenceTransformer('all-MiniLM-L6-v2')
-    vectors = model.encode(documents)
-    index = faiss.IndexFlatL2(vectors.shape[1])
-    index.add(np.array(vectors, dtype=np.float32))
-    return index, model
-
-def retrieve_relevant_content(index, model, query, documents, top_k=3):
-    """Retrieve the most relevant content from documents."""
+    vectors, model = embed_documents(documents)
+    return build_faiss_index(vectors), model
+
+def load_document_index(file_path, on_progress=None):
+    """Return the StoredDocument for a file, reusing the vector store when possible.
+
+    New documents stream through the ingestion pipeline; `on_progress(stage, info)`
+    is called as pages are extracted and chunks indexed. Across server workers a
+    document is ingested once: the others wait for it and read the stored copy.
+    """
+    store = get_vector_store()
+    settings = {"chunker": chunker_settings(), "index": index_settings()}
+    # Memoized by size and mtime, so repeated questions about a file do not re-read it
+    key = document_key(document_hash(file_path), settings, EMBEDDING_MODEL_NAME)
+    stored = store.get(key)
+    if stored is not None:
+        logging.info(f"Vector store hit for {file_path}")
+        return stored
+
+    with store.ingest_lock(key):
+        stored = store.get(key)
+        if stored is not None:
+            logging.info(f"Vector store hit for {file_path} after waiting for another ingestion")
+            return stored
+        return ingest_document(file_path, store, key, on_progress)
+
+def ingest_document(file_path, store, key, on_progress=None):
+    """Run a file through the ingestion pipeline into the store; the StoredDocument or None."""
+    if categorize_file(file_path) in TABULAR_CATEGORIES:
+        # Tables stream row records in bounded reads and are chunked by row windows. They
+        # are read here rather than in a worker, which would have to return the whole table
+        # at once; the readers are pandas' CSV parser and pure-Python openpyxl.
+        pipeline = IngestionPipeline(
+            iter_table_rows(file_path), store.writer(key), on_progress=on_progress, chunker=iter_row_chunks
+        )
+    else:
+        pages = iter_file_pages(file_path)
+        if pages is None:
+            return None
+        pipeline = IngestionPipeline(pages, store.writer(key), on_progress=on_progress)
+    try:
+        return pipeline.run(meta={"source": os.path.basename(file_path)})
+    except Exception as e:
+        logging.error(f"Error ingesting {file_path}: {e}")
+        return None
+
+def rank_chunks(index, model, query, top_k=3, nprobe=None, ef_search=None, lexical=None):
+    """Ids of the top_k chunks most relevant to query, best first.
+
+    `model` is anything with an encode() method; by default the shared embedding service.
+    `nprobe` (IVF) and `ef_search` (HNSW) trade recall for latency; flat indexes ignore them.
+    With a `lexical` InvertedIndex, BM25 and vector rankings are fused by reciprocal rank,
+    and the query is not embedded at all when the BM25 ranking is decisive.
+    """
+    if lexical is not None:
+        lexical_scores, lexical_ids = lexical.search(query, top_k * 4)
+        if lexical.is_decisive(query, lexical_scores):
+            logging.info("Lexical fast path: skipping query embedding")
+            return list(lexical_ids[:top_k])
+
+    model = model or get_embedding_service()
     query_vector = model.encode([query])
-    distances, indices = index.search(np.array(query_vector, dtype=np.float32), top_k)
-    return "\n".join([documents[i] for i in indices[0]])
+    candidates = top_k * 4 if lexical is not None else top_k
+    scores, indices = search_index(index, query_vector, candidates, nprobe=nprobe, ef_search=ef_search)
+    dense_ids = [i for i in indices[0] if i >= 0]
+    if lexical is not None:
+        dense_ids = reciprocal_rank_fusion([dense_ids, lexical_ids], top_k)
+    return dense_ids[:top_k]
 
-def send_request(prompt, file_path=None):
-    """Send request to API with relevant file content."""
-    data = {"model": "deepseek-r1:1.5b", "prompt": prompt, "stream": False}
+def retrieve_relevant_content(index, model, query, documents, top_k=3, nprobe=None, ef_search=None, lexical=None):
+    """Retrieve the most relevant content from documents (see rank_chunks)."""
+    ids = rank_chunks(index, model, query, top_k, nprobe=nprobe, ef_search=ef_search, lexical=lexical)
+    return "\n".join([documents[i] for i in ids])
+
+def read_small_document(file_path, budget):
+    """Whole text of a small file if it fits the budget, else None.
+
+    Reading stops as soon as the budget is exceeded. PDFs are read without OCR;
+    one with scanned pages goes through normal ingestion instead.
+    """
+    if os.path.getsize(file_path) > SMALL_FILE_BYTES:
+        return None
+    category = categorize_file(file_path)
+    if category in TABULAR_CATEGORIES:
+        texts = (record for _, _, record in iter_table_rows(file_path))
+    elif category == "pdf":
+        texts = (text if len(text.strip()) >= OCR_MIN_TEXT_CHARS else None
+                 for _, text in iter_pdf_pages(file_path, ocr=False))
+    else:
+        pages = iter_file_pages(file_path)
+        if pages is None:
+            return None
+        texts = (text for _, text in pages)
+
+    parts, used = [], 0
+    try:
+        for text in texts:
+            if text is None:
+                return None
+            used += estimate_tokens(text)
+            if used > budget:
+                return None
+            parts.append(text.strip())
+    except Exception as e:
+        logging.error(f"Error reading {file_path}: {e}")
+        return None
+    text = "\n\n".join(part for part in parts if part)
+    return text or None
+
+def build_context(prompt, file_path=None, loader=load_document_index, reserved_tokens=0):
+    """File content relevant to a prompt, ready to append to it.
+
+    The content is packed into the model's context budget, less reserved_tokens
+    already taken by the conversation: a document that fits whole is sent whole
+    (small files are not even embedded), otherwise the best-ranked distinct
+    chunks fill the budget. Table questions the table_qa engine understands get
+    only its computed result instead. `loader` returns a file's StoredDocument.
+    Returns "" without a file and None if the file cannot be used.
+    """
+    if not file_path:
+        return ""
 
-    if file_path:
+    category = categorize_file(file_path)
+    budget = max(context_budget(prompt) - reserved_tokens, 0)
+    if category in TABULAR_CATEGORIES and os.path.exists(file_path):
+        # Aggregates, filters and top-N are computed exactly; the small result replaces the
+        # raw rows, and states how the question was read so a misreading can be pointed out
+        from table_qa import answer_table_question  # loads pandas on the first table question
+        table_answer = answer_table_question(file_path, prompt)
+        if table_answer:
+            return ("\n\nComputed from the attached table (if this reading of the question is wrong, "
+                    f"say so):\n{truncate_to_budget(table_answer, budget)}")
+
+    if category in INDEXED_CATEGORIES and os.path.exists(file_path):
+        small_text = read_small_document(file_path, budget)
+        if small_text:
+            logging.info(f"{file_path} fits the prompt budget; skipping retrieval")
+            return f"\n\nBased on the file:\n{small_text}"
+        loaded = loader(file_path)
+        if loaded:
+            chunks = loaded.chunks
+            if document_fits(chunks, budget):
+                relevant = list(chunks)
+            else:
+                top_k = adaptive_top_k(budget, len(chunks))
+                ranked = rank_chunks(loaded.index, get_embedding_service(), prompt, top_k, lexical=loaded.lexical)
+                relevant = pack_chunks(ranked, chunks, budget)
+            return "\n\nBased on the file:\n" + "\n".join(relevant)
+    elif category == "image":
         file_content = process_file(file_path)
-        category = categorize_file(file_path)
+        if file_content:
+            return f"\n\nExtracted Text from Image:\n{truncate_to_budget(file_content, budget)}"
 
-        if file_content and category in ["pdf", "csv", "text", "docx", "pptx", "xlsx"]:
-            documents = chunk_document(file_content)
-            index, model = create_faiss_index(documents)
-            relevant_content = retrieve_relevant_content(index, model, prompt, documents)
+    logging.warning(f"Cannot process file: {file_path}")
+    return None
 
-            data["prompt"] += f"\n\nBased on the file:\n{relevant_content}"
-        elif category == "image":
-            data["prompt"] += f"\n\nExtracted Text from Image:\n{file_content}"
-        else:
-            logging.warning(f"Cannot process file: {file_path}")
-            return "Unsupported file type."
+class GenerationRequest:
+    """One turn, prepared off the event loop: the prompt to send and how to send it."""
+
+    def __init__(self, prompt, full_prompt, key=None, cached=None, options=None, prefer=None, session=None):
+        self.prompt = prompt
+        self.full_prompt = full_prompt
+        # Response cache key; None when the answer depends on earlier turns
+        self.key = key
+        self.cached = cached
+        self.options = options or {}
+        self.prefer = prefer
+        self.session = session
+
+    def finish(self, answer, result=None):
+        """Record the turn in the session."""
+        result = result or {}
+        if self.session is not None:
+            self.session.add_turn(self.prompt, answer, result.get("context"), result.get("backend_url"))
+
+    def cache_answer(self, answer):
+        """Store a newly generated answer in the response cache, when cacheable.
+
+        Called once per generation, however many coalesced requests share it. A
+        failure is logged; the answer is still good.
+        """
+        cache = get_response_cache()
+        if self.key is None or cache is None:
+            return
+        try:
+            cache.store(self.key, self.prompt, answer)
+        except Exception as e:
+            logging.error(f"Error storing response in cache: {e}")
+
+def prepare_request(prompt, file_path=None, variant="", session=None):
+    """Retrieve context, fold in the session's conversation and check the response cache.
+
+    A session continues from the Ollama `context` of its last turn, so only the
+    new prompt is sent and prefilled; when there is none (first turn after a
+    cache hit, or the context outgrew SESSION_MAX_CONTEXT_TOKENS) the recent
+    history is replayed as text instead. Returns None if the file cannot be used.
+    """
+    conversation, history = [], ""
+    if session is not None:
+        if len(session.context) > SESSION_MAX_CONTEXT_TOKENS:
+            session.reset_context()
+        conversation = session.context
+        if not conversation and session.history:
+            history = session.recent_history()
+    # The Ollama context lives in the part of num_ctx beyond the packed window
+    reserved = estimate_tokens(history)
+    loader = load_document_index
+    if session is not None:
+        loader = lambda path: session.load_document(path, load_document_index)
+
+    context = build_context(prompt, file_path, loader=loader, reserved_tokens=reserved)
+    if context is None:
+        return None
+    full_prompt = prompt + context
+    if history:
+        full_prompt = f"Conversation so far:\n{history}\n\nUser: {full_prompt}"
+    options = {"keep_alive": OLLAMA_KEEP_ALIVE, "options": {"num_ctx": SESSION_NUM_CTX}}
+    if conversation:
+        options["context"] = conversation
+
+    key = cached = None
+    if not conversation and not history:
+        key = cache_key(OLLAMA_MODEL, file_path, context, variant)
+        cache = get_response_cache()
+        cached = cache.lookup(key, prompt) if cache else None
+        if cached is not None:
+            logging.info("Answered from the response cache")
+    prefer = session.backend if session is not None and conversation else None
+    return GenerationRequest(prompt, full_prompt, key, cached, options, prefer, session)
+
+def send_request(prompt, file_path=None, session=None):
+    """Send request to API with relevant file content."""
+    request = prepare_request(prompt, file_path, session=session)
+    if request is None:
+        return UNSUPPORTED_MESSAGE
+    if request.cached is not None:
+        request.finish(request.cached)
+        return request.cached
+    data = dict(request.options, model=OLLAMA_MODEL, prompt=request.full_prompt, stream=False)
 
     try:
-        response = requests.post(url, data=json.dumps(data), headers={"Content-Type": "application/json"})
+        response = requests.post(url, data=json.dumps(data), headers={"Content-Type": "application/json"},
+                                 timeout=(OLLAMA_CONNECT_TIMEOUT, OLLAMA_READ_TIMEOUT))
         response.raise_for_status()
-        return response.json().get('response', 'No response available.')
+        result = response.json()
     except requests.exceptions.RequestException as e:
         logging.error(f"API request failed: {e}")
-        return "Failed to communicate with the API."
+        return API_ERROR_MESSAGE
+
+    answer = result.get('response', 'No response available.')
+    request.cache_answer(answer)
+    request.finish(answer, dict(result, backend_url=OLLAMA_URL))
+    return answer
+
+async def async_send_request(prompt, file_path=None, priority=INTERACTIVE, on_queued=None, session=None):
+    """Asyncio version of send_request for the servers.
+
+    Retrieval runs in a worker thread and generation goes through the pooled
+    Ollama client, so other connections keep being served meanwhile. Identical
+    requests in flight at the same time share one generation. Generations wait
+    for a slot in the model's scheduler at the given priority; on_queued is
+    awaited with the queue position and estimated wait while they do.
+    """
+    request = await run_blocking(prepare_request, prompt, file_path, session=session)
+    if request is None:
+        return UNSUPPORTED_MESSAGE
+    if request.cached is not None:
+        request.finish(request.cached)
+        return request.cached
+
+    async def generate():
+        async with get_scheduler(OLLAMA_MODEL).slot(priority, on_queued):
+            result = await get_ollama_client().generate(request.full_prompt, prefer=request.prefer, **request.options)
+        # Inside the shared call, so coalesced requests store the answer once
+        await run_blocking(request.cache_answer, result.get('response', 'No response available.'))
+        return result
+
+    try:
+        if request.key is None:
+            result = await generate()
+        else:
+            result = await get_coalescer().run(request.key + (prompt,), generate)
+    except SchedulerBusy as e:
+        logging.warning(f"Rejected generation: {e}")
+        return BUSY_MESSAGE
+    except OllamaError as e:
+        logging.error(f"API request failed: {e}")
+        return API_ERROR_MESSAGE
+
+    answer = result.get('response', 'No response available.')
+    await run_blocking(request.finish, answer, result)
+    return answer
+
+async def async_stream_request(prompt, file_path=None, hide_thinking=False, priority=INTERACTIVE, on_queued=None,
+                               session=None):
+    """Stream an answer as frames: `token` deltas, then `done` with the full text and timings.
+
+    With hide_thinking, <think> blocks are dropped server-side and a single
+    `thinking` frame tells the client the model is reasoning. A full queue
+    yields a single `busy` frame. Identical streams in flight at the same time
+    share one generation.
+    """
+    started = time.perf_counter()
+    variant = "hide_thinking" if hide_thinking else ""
+    request = await run_blocking(prepare_request, prompt, file_path, variant, session)
+    if request is None:
+        yield {"type": "error", "error": UNSUPPORTED_MESSAGE}
+        return
+    prompt_ready = time.perf_counter()
+    if request.cached is not None:
+        request.finish(request.cached)
+        elapsed = round((prompt_ready - started) * 1000, 1)
+        yield {"type": "token", "delta": request.cached}
+        yield {"type": "done", "response": request.cached,
+               "stats": {"cached": True, "time_to_first_token_ms": elapsed, "total_ms": elapsed}}
+        return
+
+    async def generate():
+        # Shared by coalesced requests: `admitted` and `generated` frames mark when the
+        # slot was granted and carry Ollama's final chunk; they are not sent to clients
+        think_filter = ThinkFilter() if hide_thinking else None
+        parts = []
+        final = {}
+        try:
+            async with get_scheduler(OLLAMA_MODEL).slot(priority, on_queued):
+                yield {"type": "admitted"}
+                chunks = get_ollama_client().stream(request.full_prompt, prefer=request.prefer, **request.options)
+                async for chunk in chunks:
+                    delta = chunk.get("response", "")
+                    if think_filter:
+                        was_thinking = think_filter.thinking
+                        delta = think_filter.feed(delta)
+                        if think_filter.thinking and not was_thinking:
+                            yield {"type": "thinking"}
+                    if delta:
+                        parts.append(delta)
+                        yield {"type": "token", "delta": delta}
+                    if chunk.get("done"):
+                        final = chunk
+            tail = think_filter.flush() if think_filter else ""
+            if tail:
+                parts.append(tail)
+                yield {"type": "token", "delta": tail}
+        except SchedulerBusy as e:
+            logging.warning(f"Rejected generation: {e}")
+            yield {"type": "busy", "error": BUSY_MESSAGE}
+            return
+        except OllamaError as e:
+            logging.error(f"API request failed: {e}")
+            yield {"type": "error", "error": API_ERROR_MESSAGE}
+            return
+        if final:
+            await run_blocking(request.cache_answer, "".join(parts))
+        yield {"type": "generated", "final": final}
+
+    if request.key is None:
+        frames = generate()
+    else:
+        frames = get_coalescer().stream(request.key + (prompt,), generate)
+    parts = []
+    admitted = first_token = None
+    final = {}
+    async for frame in frames:
+        if frame["type"] == "admitted":
+            admitted = time.perf_counter()
+            continue
+        if frame["type"] == "generated":
+            final = frame["final"]
+            continue
+        if frame["type"] in ("busy", "error"):
+            yield frame
+            return
+        if first_token is None:
+            first_token = time.perf_counter()
+        if frame["type"] == "token":
+            parts.append(frame["delta"])
+        yield frame
+
+    finished = time.perf_counter()
+    answer = "".join(parts)
+    if final:
+        await run_blocking(request.finish, answer, final)
+    eval_count = final.get("eval_count", 0)
+    eval_seconds = final.get("eval_duration", 0) / 1e9
+    yield {
+        "type": "done",
+        "response": answer,
+        "stats": {
+            "cached": False,
+            "prompt_build_ms": round((prompt_ready - started) * 1000, 1),
+            "queued_ms": round((admitted - prompt_ready) * 1000, 1) if admitted else None,
+            "time_to_first_token_ms": round((first_token - started) * 1000, 1) if first_token else None,
+            "total_ms": round((finished - started) * 1000, 1),
+            "prompt_tokens": final.get("prompt_eval_count"),
+            "completion_tokens": eval_count,
+            "tokens_per_second": round(eval_count / eval_seconds, 1) if eval_seconds else None,
+        },
+    }
 
 def interactive_chat():
     """Interactive chat with file support."""
+    session = get_session_store().get()
     while True:
         prompt = input("Enter your prompt (or type 'exit' to quit): ")
         if prompt.lower() == "exit":
             break
         file_path = input("Enter file path (or leave blank): ").strip('"') or None
-        result = send_request(prompt, file_path)
+        result = send_request(prompt, file_path, session=session)
         print(result)
 
 if __name__ == "__main__":
@@ -0,0 +1,80 @@
+# The extractors run in worker processes through extract_office_pages, so a
+# malformed file crashes a worker rather than the server; python-docx and
+# python-pptx are only ever imported there. XLSX workbooks are tables and
+# belong to tabular.iter_xlsx_rows, not this module.
+
+def _row_text(cells):
+    """Join table cells, skipping empties and the repeats python-docx returns for merged cells."""
+    values = []
+    for cell in cells:
+        text = cell.strip() if isinstance(cell, str) else ("" if cell is None else str(cell))
+        if text and (not values or values[-1] != text):
+            values.append(text)
+    return " | ".join(values)
+
+def _starts_new_page(paragraph):
+    """Whether Word placed a page break in this paragraph (hard or last rendered)."""
+    return bool(paragraph._p.xpath('./w:r/w:br[@w:type="page"] | ./w:r/w:lastRenderedPageBreak'))
+
+def iter_docx_pages(file_path):
+    """Yield (page_number, text) records of paragraphs and tables in document order.
+
+    DOCX files carry no layout, so pages follow the page breaks Word recorded.
+    """
+    from docx import Document  # DOCX file handling
+    from docx.table import Table
+    from docx.text.paragraph import Paragraph
+    document = Document(file_path)
+    page, lines = 1, []
+    for child in document.element.body.iterchildren():
+        tag = child.tag.rsplit("}", 1)[-1]
+        if tag == "p":
+            paragraph = Paragraph(child, document)
+            if _starts_new_page(paragraph) and lines:
+                yield page, "\n".join(lines)
+                page, lines = page + 1, []
+            if paragraph.text.strip():
+                lines.append(paragraph.text)
+        elif tag == "tbl":
+            for row in Table(child, document).rows:
+                text = _row_text(cell.text for cell in row.cells)
+                if text:
+                    lines.append(text)
+    if lines:
+        yield page, "\n".join(lines)
+
+def _shape_text(shapes):
+    """Text of slide shapes, including tables and grouped shapes."""
+    from pptx.enum.shapes import MSO_SHAPE_TYPE
+    for shape in shapes:
+        if shape.shape_type == MSO_SHAPE_TYPE.GROUP:
+            yield from _shape_text(shape.shapes)
+        elif shape.has_text_frame:
+            if shape.text_frame.text.strip():
+                yield shape.text_frame.text
+        elif getattr(shape, "has_table", False) and shape.has_table:
+            for row in shape.table.rows:
+                text = _row_text(cell.text for cell in row.cells)
+                if text:
+                    yield text
+
+def iter_pptx_pages(file_path):
+    """Yield one (slide_number, text) record per slide, speaker notes included."""
+    from pptx import Presentation  # PPTX file handling
+    presentation = Presentation(file_path)
+    for number, slide in enumerate(presentation.slides, start=1):
+        lines = list(_shape_text(slide.shapes))
+        if slide.has_notes_slide:
+            notes = slide.notes_slide.notes_text_frame.text.strip()
+            if notes:
+                lines.append(f"Notes: {notes}")
+        yield number, "\n".join(lines)
+
+OFFICE_EXTRACTORS = {
+    "docx": iter_docx_pages,
+    "pptx": iter_pptx_pages,
+}
+
+def extract_office_pages(file_path, category):
+    """All (page_number, text) records of a DOCX or PPTX; runs in a worker process."""
+    return list(OFFICE_EXTRACTORS[category](file_path))
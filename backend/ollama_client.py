@@ -0,0 +1,171 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import weakref
+import httpx
+from ollama_pool import BackendPool, OLLAMA_URLS
+
+# Ollama connection settings (override through the environment)
+# OLLAMA_URLS (see ollama_pool) lists every server; the first is used by blocking callers
+OLLAMA_URL = OLLAMA_URLS[0]
+OLLAMA_MODEL = os.environ.get("OLLAMA_MODEL", "deepseek-r1:1.5b")
+OLLAMA_CONNECT_TIMEOUT = float(os.environ.get("OLLAMA_CONNECT_TIMEOUT", "5"))
+# Generations can legitimately take minutes; this bounds a stalled read, not the whole answer
+OLLAMA_READ_TIMEOUT = float(os.environ.get("OLLAMA_READ_TIMEOUT", "300"))
+OLLAMA_MAX_RETRIES = int(os.environ.get("OLLAMA_MAX_RETRIES", "3"))
+OLLAMA_POOL_SIZE = int(os.environ.get("OLLAMA_POOL_SIZE", "32"))
+OLLAMA_RETRY_BASE_DELAY = 0.25
+# How long Ollama keeps the model (and a conversation's KV cache) loaded after a request
+OLLAMA_KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "30m")
+
+# Failures that mean the request never reached a working model server, so retrying is safe
+RETRYABLE_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout, httpx.RemoteProtocolError)
+RETRYABLE_STATUS = {429, 502, 503, 504}
+# Responses from a live but busy server, which should not count toward ejecting it
+OVERLOADED_STATUS = {429, 503}
+
+class OllamaError(Exception):
+    """Raised when Ollama cannot produce a response after retries."""
+
+class OllamaClient:
+    """Asyncio Ollama client over a persistent keep-alive connection pool.
+
+    Requests are routed over the servers of a BackendPool; a retry goes to a
+    backend that has not been tried for this request yet when there is one.
+    """
+
+    def __init__(self, urls=None, max_retries=OLLAMA_MAX_RETRIES, pool_size=OLLAMA_POOL_SIZE):
+        self.pool = BackendPool(urls)
+        self.max_retries = max_retries
+        self._client = httpx.AsyncClient(
+            timeout=httpx.Timeout(OLLAMA_READ_TIMEOUT, connect=OLLAMA_CONNECT_TIMEOUT, pool=OLLAMA_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        )
+        if len(self.pool.backends) > 1:
+            self.pool.start_health_checks(self._client)
+
+    async def _backoff(self, attempt):
+        # Full jitter keeps retries from many clients from arriving in lockstep
+        await asyncio.sleep(random.uniform(0, OLLAMA_RETRY_BASE_DELAY * 2 ** attempt))
+
+    async def _next_backend(self, model, tried, attempt, prefer=None):
+        """Acquire a backend for this attempt, backing off once every backend has been tried."""
+        backend = self.pool.acquire(model, exclude=tried, prefer=prefer)
+        if backend is None:
+            tried.clear()
+            await self._backoff(attempt)
+            backend = self.pool.acquire(model, prefer=prefer)
+        tried.add(backend)
+        return backend
+
+    async def post(self, path, payload, prefer=None):
+        """POST JSON with retries on connection failures and overload responses.
+
+        The parsed response gets a `backend_url` entry naming the server that answered.
+        """
+        model = payload.get("model")
+        tried = set()
+        for attempt in range(self.max_retries + 1):
+            backend = await self._next_backend(model, tried, attempt, prefer)
+            failed, served = False, False
+            try:
+                response = await self._client.post(backend.url + path, json=payload)
+                if response.status_code in RETRYABLE_STATUS and attempt < self.max_retries:
+                    logging.warning(f"Ollama at {backend.url} returned {response.status_code}; retrying")
+                    failed = response.status_code not in OVERLOADED_STATUS
+                    continue
+                response.raise_for_status()
+                try:
+                    body = response.json()
+                except ValueError as e:
+                    failed = True
+                    raise OllamaError(f"Malformed response from Ollama at {backend.url}: {e}") from e
+                served = True
+                return dict(body, backend_url=backend.url)
+            except RETRYABLE_ERRORS as e:
+                failed = True
+                if attempt == self.max_retries:
+                    raise OllamaError(f"Ollama unreachable at {backend.url}: {e}") from e
+                logging.warning(f"Ollama request to {backend.url} failed ({e!r}); retrying")
+            except httpx.HTTPError as e:
+                raise OllamaError(f"Ollama request failed: {e}") from e
+            finally:
+                self.pool.release(backend, model if served else None, ok=not failed)
+
+    async def generate(self, prompt, model=OLLAMA_MODEL, prefer=None, **options):
+        """Run a non-streaming generation and return Ollama's JSON response.
+
+        Cancelling the calling task closes the underlying request, so Ollama
+        stops generating for a client that has gone away. prefer is a backend
+        URL to route to when possible (see BackendPool.choose).
+        """
+        payload = dict(options, model=model, prompt=prompt, stream=False)
+        return await self.post("/api/generate", payload, prefer)
+
+    async def stream(self, prompt, model=OLLAMA_MODEL, prefer=None, **options):
+        """Yield Ollama's NDJSON chunks for a streaming generation as they arrive.
+
+        Connection failures are retried until the response starts; after that an
+        error ends the stream, since tokens have already been handed out. The
+        final chunk gets a `backend_url` entry naming the server that answered.
+        """
+        payload = dict(options, model=model, prompt=prompt, stream=True)
+        started = False
+        tried = set()
+        for attempt in range(self.max_retries + 1):
+            backend = await self._next_backend(model, tried, attempt, prefer)
+            failed = False
+            try:
+                async with self._client.stream("POST", backend.url + "/api/generate", json=payload) as response:
+                    if response.status_code in RETRYABLE_STATUS and attempt < self.max_retries:
+                        logging.warning(f"Ollama at {backend.url} returned {response.status_code}; retrying")
+                        failed = response.status_code not in OVERLOADED_STATUS
+                        continue
+                    response.raise_for_status()
+                    async for line in response.aiter_lines():
+                        if not line.strip():
+                            continue
+                        try:
+                            chunk = json.loads(line)
+                        except ValueError as e:
+                            # A truncated or garbled line; the stream cannot be resumed from it
+                            failed = True
+                            raise OllamaError(f"Malformed stream line from Ollama at {backend.url}: {line[:100]!r}") from e
+                        if "error" in chunk:
+                            raise OllamaError(f"Ollama error: {chunk['error']}")
+                        started = True
+                        if chunk.get("done"):
+                            chunk["backend_url"] = backend.url
+                        yield chunk
+                    return
+            except RETRYABLE_ERRORS as e:
+                failed = True
+                if started or attempt == self.max_retries:
+                    raise OllamaError(f"Ollama unreachable at {backend.url}: {e}") from e
+                logging.warning(f"Ollama request to {backend.url} failed ({e!r}); retrying")
+            except httpx.HTTPError as e:
+                raise OllamaError(f"Ollama request failed: {e}") from e
+            finally:
+                self.pool.release(backend, model if started else None, ok=not failed)
+
+    async def close(self):
+        await self.pool.close()
+        await self._client.aclose()
+
+# httpx pools are tied to the event loop that created them, so there is one client per loop
+_clients = weakref.WeakKeyDictionary()
+
+def get_ollama_client():
+    """Return the Ollama client of the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = _clients[loop] = OllamaClient()
+    return client
+
+async def close_ollama_client():
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.close()
@@ -0,0 +1,140 @@
+import asyncio
+import logging
+import os
+import random
+import time
+import httpx
+
+# Ollama servers to spread generations over, comma-separated (override through the environment)
+OLLAMA_URLS = [
+    url.strip().rstrip("/")
+    for url in os.environ.get("OLLAMA_URLS", os.environ.get("OLLAMA_URL", "http://localhost:11434")).split(",")
+    if url.strip()
+]
+OLLAMA_HEALTH_INTERVAL = float(os.environ.get("OLLAMA_HEALTH_INTERVAL", "10"))
+# Consecutive failures before a backend stops receiving traffic
+OLLAMA_EJECT_AFTER = int(os.environ.get("OLLAMA_EJECT_AFTER", "2"))
+# Extra outstanding requests a session's own backend may have and still be preferred
+OLLAMA_AFFINITY_SLACK = int(os.environ.get("OLLAMA_AFFINITY_SLACK", "2"))
+
+def model_tag(name):
+    """Ollama treats a bare model name as its :latest tag."""
+    return name if ":" in name else f"{name}:latest"
+
+class Backend:
+    """One Ollama server and what the pool knows about it."""
+
+    def __init__(self, url):
+        self.url = url
+        self.outstanding = 0
+        self.healthy = True
+        self.failures = 0
+        self.loaded_models = set()
+        self.checked_at = None
+
+    def __repr__(self):
+        state = "up" if self.healthy else "ejected"
+        return f"Backend({self.url}, {state}, outstanding={self.outstanding}, loaded={sorted(self.loaded_models)})"
+
+class BackendPool:
+    """Routes requests over several Ollama servers.
+
+    Each request goes to the healthy backend with the fewest outstanding
+    requests, preferring backends that already have the model in memory (a cold
+    model costs a load of several seconds). Backends are ejected after
+    consecutive failures and re-admitted once a health check succeeds.
+    """
+
+    def __init__(self, urls=None, health_interval=OLLAMA_HEALTH_INTERVAL, eject_after=OLLAMA_EJECT_AFTER):
+        self.backends = [Backend(url.rstrip("/")) for url in (urls or OLLAMA_URLS)]
+        self.health_interval = health_interval
+        self.eject_after = eject_after
+        self._health_task = None
+
+    def choose(self, model, exclude=(), prefer=None):
+        """Backend for the next request, or None if every candidate was excluded.
+
+        prefer is the URL of a backend holding this conversation's KV cache; it
+        is used while healthy and not much busier than the least loaded one.
+        """
+        candidates = [b for b in self.backends if b not in exclude]
+        if not candidates:
+            return None
+        healthy = [b for b in candidates if b.healthy]
+        if not healthy:
+            # Everything looks down: try the backend that failed least rather than nothing
+            return min(candidates, key=lambda b: b.failures)
+        warm = [b for b in healthy if model_tag(model) in b.loaded_models]
+        pool = warm or healthy
+        least = min(b.outstanding for b in pool)
+        for backend in healthy:
+            if backend.url == prefer and backend.outstanding <= least + OLLAMA_AFFINITY_SLACK:
+                return backend
+        return random.choice([b for b in pool if b.outstanding == least])
+
+    def acquire(self, model, exclude=(), prefer=None):
+        backend = self.choose(model, exclude, prefer)
+        if backend is not None:
+            backend.outstanding += 1
+        return backend
+
+    def release(self, backend, model=None, ok=True):
+        backend.outstanding -= 1
+        if ok:
+            backend.failures = 0
+            if model:
+                backend.loaded_models.add(model_tag(model))
+        else:
+            self.mark_failed(backend)
+
+    def mark_failed(self, backend):
+        backend.failures += 1
+        if backend.healthy and backend.failures >= self.eject_after:
+            backend.healthy = False
+            logging.warning(f"Ejected Ollama backend {backend.url} after {backend.failures} failures")
+
+    async def check(self, client, backend):
+        """Probe one backend with /api/ps, refreshing its loaded models."""
+        try:
+            response = await client.get(f"{backend.url}/api/ps", timeout=5)
+            response.raise_for_status()
+            backend.loaded_models = {
+                model_tag(m.get("model") or m.get("name", "")) for m in response.json().get("models", [])
+            }
+            if not backend.healthy:
+                logging.info(f"Re-admitted Ollama backend {backend.url}")
+            backend.healthy = True
+            backend.failures = 0
+        except (httpx.HTTPError, ValueError) as e:
+            logging.warning(f"Health check failed for {backend.url}: {e!r}")
+            self.mark_failed(backend)
+        backend.checked_at = time.monotonic()
+
+    async def check_all(self, client):
+        await asyncio.gather(*(self.check(client, backend) for backend in self.backends))
+
+    def start_health_checks(self, client):
+        """Run check_all every health_interval seconds on the running loop."""
+        if self._health_task is None or self._health_task.done():
+            self._health_task = asyncio.get_running_loop().create_task(self._health_loop(client))
+
+    async def _health_loop(self, client):
+        while True:
+            await self.check_all(client)
+            await asyncio.sleep(self.health_interval)
+
+    async def close(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            try:
+                await self._health_task
+            except asyncio.CancelledError:
+                pass
+            self._health_task = None
+
+    def stats(self):
+        return [
+            {"url": b.url, "healthy": b.healthy, "outstanding": b.outstanding,
+             "failures": b.failures, "loaded_models": sorted(b.loaded_models)}
+            for b in self.backends
+        ]
@@ -0,0 +1,155 @@
+import hashlib
+import io
+import logging
+import os
+from collections import deque
+from workers import get_process_pool
+
+# PyMuPDF, pytesseract and PIL are imported inside the functions that run in
+# worker processes; the server process itself never needs them
+
+# Parallel extraction settings (override through the environment)
+PDF_WORKERS = int(os.environ.get("PDF_WORKERS", str(os.cpu_count() or 1)))
+PDF_PAGES_PER_TASK = int(os.environ.get("PDF_PAGES_PER_TASK", "64"))
+# Below this many pages a PDF is extracted as a single task rather than split
+PDF_MIN_PARALLEL_PAGES = int(os.environ.get("PDF_MIN_PARALLEL_PAGES", "32"))
+
+# OCR fallback settings
+OCR_DPI = int(os.environ.get("OCR_DPI", "200"))
+# Pages with less extracted text than this are treated as scanned
+OCR_MIN_TEXT_CHARS = int(os.environ.get("OCR_MIN_TEXT_CHARS", "20"))
+OCR_CACHE_DIR = os.environ.get("OCR_CACHE_DIR", "ocr_cache")
+# Least recently used OCR results are deleted past this size
+OCR_CACHE_MAX_BYTES = int(os.environ.get("OCR_CACHE_MAX_BYTES", str(256 * 1024 ** 2)))
+# The tesseract binary; on PATH by default, set the full path on Windows
+TESSERACT_CMD = os.environ.get("TESSERACT_CMD", "tesseract")
+
+def extract_page_range(file_path, start, end):
+    """Extract (page_number, text) records for pages [start, end); runs in a worker."""
+    import fitz  # PyMuPDF for PDF handling
+    with fitz.open(file_path) as pdf:
+        return [(number + 1, pdf[number].get_text()) for number in range(start, min(end, pdf.page_count))]
+
+def count_pages(file_path):
+    import fitz
+    with fitz.open(file_path) as pdf:
+        return pdf.page_count
+
+def iter_pdf_pages(file_path, workers=PDF_WORKERS, pages_per_task=PDF_PAGES_PER_TASK, ocr=True):
+    """Yield (page_number, text) records in page order as page ranges finish.
+
+    PyMuPDF only ever opens the file in worker processes, so a PDF that crashes
+    or hangs it fails with WorkerFailed instead of taking the server down.
+    Large PDFs are split into page ranges that the workers extract in parallel,
+    each opening its own fitz document. At most two ranges per worker are in
+    flight, so a slow consumer holds extraction back. With `ocr`, scanned pages
+    of each range are OCR'd before the range is yielded.
+    """
+    pool = get_process_pool()
+    page_count = pool.run(count_pages, file_path)
+    finish = (lambda records: ocr_missing_pages(file_path, records)) if ocr else (lambda records: records)
+    if workers <= 1 or page_count < PDF_MIN_PARALLEL_PAGES:
+        step = pages_per_task
+    else:
+        # Enough ranges to keep every worker busy, but no smaller than needed
+        step = max(1, min(pages_per_task, -(-page_count // workers)))
+        logging.info(f"Extracting {page_count} pages in ranges of {step}")
+    pending = deque()
+    for start in range(0, page_count, step):
+        pending.append(pool.submit(extract_page_range, file_path, start, start + step))
+        if len(pending) >= 2 * max(workers, 1):
+            yield from finish(pending.popleft().result())
+    while pending:
+        yield from finish(pending.popleft().result())
+
+def extract_pdf_pages(file_path, workers=PDF_WORKERS, pages_per_task=PDF_PAGES_PER_TASK):
+    """Extract (page_number, text) records for every page, in page order."""
+    return list(iter_pdf_pages(file_path, workers, pages_per_task, ocr=False))
+
+def ocr_page(file_path, page_number, dpi=OCR_DPI, tesseract_cmd=TESSERACT_CMD, cache_dir=OCR_CACHE_DIR):
+    """Rasterize one page and OCR it; runs in a worker.
+
+    Only this page's pixmap is ever in memory. Results are cached on disk by the
+    hash of the rendered pixels, so repeated scans of the same page skip Tesseract;
+    a hit refreshes the file's mtime, the cache's LRU clock (see evict_ocr_cache).
+    """
+    import fitz
+    import pytesseract  # OCR for scanned pages
+    from PIL import Image  # Image processing
+    if tesseract_cmd:
+        pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+    with fitz.open(file_path) as pdf:
+        pixmap = pdf[page_number - 1].get_pixmap(dpi=dpi)
+    digest = hashlib.sha256(pixmap.samples).hexdigest()
+    cache_path = os.path.join(cache_dir, f"{digest}-{dpi}.txt")
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            text = f.read()
+        os.utime(cache_path)
+        return page_number, text
+    except FileNotFoundError:
+        pass  # not cached, or evicted meanwhile
+
+    image = Image.open(io.BytesIO(pixmap.tobytes("png")))
+    text = pytesseract.image_to_string(image)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, cache_path)
+    return page_number, text
+
+def evict_ocr_cache(cache_dir=OCR_CACHE_DIR, max_bytes=OCR_CACHE_MAX_BYTES):
+    """Delete least recently used OCR results until the cache fits in max_bytes."""
+    entries, total = [], 0
+    try:
+        names = os.listdir(cache_dir)
+    except FileNotFoundError:
+        return
+    for name in names:
+        path = os.path.join(cache_dir, name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+        total += stat.st_size
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass  # another server worker evicted it first
+        total -= size
+
+def ocr_missing_pages(file_path, pages, dpi=OCR_DPI):
+    """OCR the pages whose extracted text is (nearly) empty, in the worker pool.
+
+    Returns the records with OCR text substituted for those pages; pages that
+    fail OCR keep their original text.
+    """
+    missing = [number for number, text in pages if len(text.strip()) < OCR_MIN_TEXT_CHARS]
+    if not missing:
+        return pages
+
+    logging.info(f"Running OCR on {len(missing)} of {len(pages)} pages at {dpi} DPI")
+    pool = get_process_pool()
+    tasks = [pool.submit(ocr_page, file_path, number, dpi, TESSERACT_CMD, OCR_CACHE_DIR) for number in missing]
+    ocr_text = {}
+    for number, task in zip(missing, tasks):
+        try:
+            ocr_text[number] = task.result()[1]
+        except Exception as e:
+            logging.error(f"OCR failed for page {number} of {file_path}: {e}")
+    evict_ocr_cache()
+    return [(number, ocr_text.get(number, text)) for number, text in pages]
+
+def ocr_image(file_path, tesseract_cmd=TESSERACT_CMD):
+    """OCR an image file; runs in a worker."""
+    import pytesseract
+    from PIL import Image
+    if tesseract_cmd:
+        pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+    with Image.open(file_path) as image:
+        return pytesseract.image_to_string(image)
@@ -0,0 +1,172 @@
+import logging
+import os
+import queue
+import threading
+import time
+from chunking import iter_chunks
+from embeddings import get_embedding_service, INGEST_PRIORITY
+from lexical import InvertedIndexBuilder
+from vector_index import build_index, choose_index_type, incremental_index, normalize_vectors
+
+# Pipeline settings (override through the environment)
+PIPELINE_QUEUE_SIZE = int(os.environ.get("PIPELINE_QUEUE_SIZE", "8"))
+PIPELINE_EMBED_BATCH = int(os.environ.get("PIPELINE_EMBED_BATCH", "256"))
+
+_DONE = object()
+
+class _Failure:
+    """Carries a stage's exception downstream so the consumer can re-raise it."""
+
+    def __init__(self, error):
+        self.error = error
+
+class IngestionPipeline:
+    """Streaming extract -> chunk -> embed -> index ingestion.
+
+    Each stage runs in its own thread and hands work to the next through a
+    bounded queue, so a slow stage applies backpressure instead of letting pages,
+    chunks or vectors pile up. Chunks and vectors go straight to a DocumentWriter
+    on disk. A flat index is filled as the vectors arrive and is the one published;
+    any other kind is built once at the end from the memory-mapped vectors, so
+    only the index itself grows with the document.
+    """
+
+    def __init__(self, pages, writer, service=None, on_progress=None, chunker=iter_chunks,
+                 queue_size=PIPELINE_QUEUE_SIZE, batch_size=PIPELINE_EMBED_BATCH):
+        self.pages = pages
+        self.writer = writer
+        # Turns the stream of page records into Chunks (tables use row windows)
+        self.chunker = chunker
+        self.service = service or get_embedding_service()
+        self.on_progress = on_progress
+        self.batch_size = batch_size
+        self._page_queue = queue.Queue(maxsize=queue_size)
+        self._chunk_queue = queue.Queue(maxsize=queue_size)
+        self._vector_queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self.pages_done = 0
+
+    def _put(self, q, item):
+        """Put with backpressure, giving up once the pipeline is stopping."""
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _drain(self, q):
+        """Yield items until _DONE; re-raise an upstream failure."""
+        while True:
+            try:
+                item = q.get(timeout=0.1)
+            except queue.Empty:
+                if self._stop.is_set():
+                    return
+                continue
+            if item is _DONE:
+                return
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+
+    def _stage(self, target, downstream):
+        def run():
+            try:
+                target()
+                self._put(downstream, _DONE)
+            except Exception as e:
+                self._put(downstream, _Failure(e))
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    def _read_pages(self):
+        for page in self.pages:
+            if not self._put(self._page_queue, page):
+                return
+            self.pages_done += 1
+            self._report("extracted", pages=self.pages_done)
+
+    def _chunk(self):
+        batch = []
+        for chunk in self.chunker(self._drain(self._page_queue)):
+            batch.append(chunk)
+            if len(batch) >= self.batch_size:
+                if not self._put(self._chunk_queue, batch):
+                    return
+                batch = []
+        if batch:
+            self._put(self._chunk_queue, batch)
+
+    def _embed(self):
+        # Only submit here; the embedding service encodes while chunking continues
+        for batch in self._drain(self._chunk_queue):
+            future = self.service.submit([chunk.text for chunk in batch], INGEST_PRIORITY)
+            if not self._put(self._vector_queue, (batch, future)):
+                return
+
+    def _report(self, stage, **info):
+        if self.on_progress is not None:
+            try:
+                self.on_progress(stage, info)
+            except Exception as e:
+                logging.error(f"Progress callback failed: {e}")
+
+    def run(self, meta=None):
+        """Ingest every page and publish the document; returns the StoredDocument or None if empty."""
+        started = time.perf_counter()
+        threads = [
+            self._stage(self._read_pages, self._page_queue),
+            self._stage(self._chunk, self._chunk_queue),
+            self._stage(self._embed, self._vector_queue),
+        ]
+        lexical = InvertedIndexBuilder()
+        index = first_indexed = None
+        try:
+            for batch, future in self._drain(self._vector_queue):
+                vectors = future.result()
+                texts = [chunk.text for chunk in batch]
+                self.writer.add(texts, vectors, [(c.start, c.end, c.page) for c in batch])
+                for text in texts:
+                    lexical.add(text)
+                if first_indexed is None:
+                    first_indexed = time.perf_counter()
+                    index = incremental_index(self.writer.dimension)
+                if index is not None and choose_index_type(self.writer.count) != "flat":
+                    logging.info(f"{self.writer.count} chunks call for an ANN index; building it at the end")
+                    index = None
+                if index is not None:
+                    index.add(normalize_vectors(vectors))
+                self._report("indexed", chunks=self.writer.count)
+        except Exception:
+            self._stop.set()
+            self.writer.abort()
+            raise
+        finally:
+            for thread in threads:
+                thread.join(timeout=1)
+
+        if self.writer.count == 0:
+            self.writer.abort()
+            return None
+
+        try:
+            if index is None:
+                index = build_index(self.writer.embeddings())
+            stored = self.writer.finish(index, lexical.build(), meta)
+        except Exception:
+            self.writer.abort()
+            raise
+        # Readers see the document once it is published, so that is when its first chunk
+        # becomes searchable; the gap after first_indexed is what ingestion still adds
+        searchable = time.perf_counter()
+        logging.info(
+            f"Ingested {self.pages_done} page/row records into {self.writer.count} chunks in "
+            f"{searchable - started:.2f}s; first chunk searchable {searchable - first_indexed:.2f}s "
+            f"after it was indexed"
+        )
+        self._report("done", chunks=self.writer.count, pages=self.pages_done,
+                     first_searchable_s=round(searchable - started, 3))
+        return stored
@@ -0,0 +1,101 @@
+import math
+import os
+import re
+from chunking import count_tokens, CHUNK_MAX_TOKENS
+
+# Prompt budget settings (override through the environment). CONTEXT_WINDOW_TOKENS is
+# the window one turn is packed for; the num_ctx sent to Ollama (sessions.SESSION_NUM_CTX)
+# adds room for the conversation before it.
+CONTEXT_WINDOW_TOKENS = int(os.environ.get("CONTEXT_WINDOW_TOKENS", "4096"))
+# Room left for the model's answer (DeepSeek-R1 thinks out loud before answering)
+ANSWER_RESERVE_TOKENS = int(os.environ.get("ANSWER_RESERVE_TOKENS", "1536"))
+# count_tokens counts words and punctuation; subword tokenizers produce somewhat more
+TOKEN_ESTIMATE_FACTOR = float(os.environ.get("TOKEN_ESTIMATE_FACTOR", "1.3"))
+# Files up to this size are read whole first; if their text fits, nothing is embedded
+SMALL_FILE_BYTES = int(os.environ.get("SMALL_FILE_BYTES", str(256 * 1024)))
+MIN_TOP_K = 3
+# Word-set overlap at which two chunks count as the same content
+DUPLICATE_OVERLAP = 0.9
+# Headers, separators and instructions around the file content
+PROMPT_OVERHEAD_TOKENS = 32
+
+_WORD_RE = re.compile(r"\w+")
+
+def estimate_tokens(text):
+    """Conservative model-token estimate for text."""
+    return math.ceil(count_tokens(text) * TOKEN_ESTIMATE_FACTOR)
+
+def context_budget(prompt):
+    """Tokens available for file content alongside this prompt."""
+    used = estimate_tokens(prompt) + ANSWER_RESERVE_TOKENS + PROMPT_OVERHEAD_TOKENS
+    return max(CONTEXT_WINDOW_TOKENS - used, 0)
+
+def fits(text, budget):
+    return estimate_tokens(text) <= budget
+
+def adaptive_top_k(budget, num_chunks):
+    """How many chunks to retrieve: enough to fill the budget with some spare for duplicates."""
+    per_chunk = CHUNK_MAX_TOKENS * TOKEN_ESTIMATE_FACTOR
+    return min(num_chunks, max(MIN_TOP_K, math.ceil(1.5 * budget / per_chunk)))
+
+def document_fits(chunks, budget):
+    """Whether every chunk of a document together fits the budget.
+
+    Only small documents are counted; anything with more chunks than the budget
+    could hold at the minimum useful chunk size is rejected without reading it.
+    Chunks are measured rather than assumed to be CHUNK_MAX_TOKENS at most, since
+    documents stored by older chunkers can hold larger ones.
+    """
+    if len(chunks) > 4 * budget / CHUNK_MAX_TOKENS:
+        return False
+    total = 0
+    for i in range(len(chunks)):
+        total += estimate_tokens(chunks[i])
+        if total > budget:
+            return False
+    return True
+
+def _words(text):
+    return frozenset(word.lower() for word in _WORD_RE.findall(text))
+
+def _is_duplicate(words, seen):
+    for other in seen:
+        smaller = min(len(words), len(other))
+        if smaller and len(words & other) / smaller >= DUPLICATE_OVERLAP:
+            return True
+    return False
+
+def pack_chunks(ranked_ids, chunks, budget):
+    """Fill the budget with the highest-ranked chunks, skipping (near-)duplicates.
+
+    ranked_ids are chunk ids best first. Chunks that do not fit are skipped so a
+    smaller, lower-ranked one can still use the remaining room. The packed chunks
+    are returned in document order so neighbouring passages read naturally.
+    """
+    packed, seen, used = [], [], 0
+    for i in ranked_ids:
+        text = chunks[i]
+        tokens = estimate_tokens(text)
+        if used + tokens > budget:
+            continue
+        words = _words(text)
+        if _is_duplicate(words, seen):
+            continue
+        packed.append(i)
+        seen.append(words)
+        used += tokens
+        if budget - used < CHUNK_MAX_TOKENS // 4:
+            break
+    return [chunks[i] for i in sorted(packed)]
+
+def truncate_to_budget(text, budget):
+    """Longest prefix of text, cut at a line or sentence end, that fits the budget."""
+    if fits(text, budget):
+        return text
+    words = max(int(budget / TOKEN_ESTIMATE_FACTOR), 0)
+    matches = list(re.finditer(r"\w+|[^\w\s]", text))
+    if words >= len(matches):
+        return text
+    cut = matches[words].start() if words else 0
+    boundary = max(text.rfind("\n", 0, cut), text.rfind(". ", 0, cut))
+    return text[:boundary + 1 if boundary > cut // 2 else cut].rstrip()
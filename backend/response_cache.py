@@ -0,0 +1,238 @@
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+import time
+import weakref
+from collections import OrderedDict
+import numpy as np
+from embeddings import get_embedding_service
+from vector_index import normalize_vectors
+from vector_store import hash_file
+
+# Response cache settings (override through the environment)
+RESPONSE_CACHE_ENABLED = os.environ.get("RESPONSE_CACHE_ENABLED", "1") == "1"
+# Cosine similarity two prompts need (on the same model, document and context) to share an answer
+RESPONSE_CACHE_THRESHOLD = float(os.environ.get("RESPONSE_CACHE_THRESHOLD", "0.95"))
+RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", "3600"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", "2000"))
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 ** 2)))
+
+_file_hashes = {}  # (path, size, mtime_ns) -> sha256
+_file_hashes_lock = threading.Lock()
+
+def document_hash(file_path):
+    """SHA-256 of a file, remembered while its size and mtime are unchanged."""
+    if not file_path:
+        return ""
+    stat = os.stat(file_path)
+    key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+    with _file_hashes_lock:
+        if key in _file_hashes:
+            return _file_hashes[key]
+    digest = hash_file(file_path)
+    with _file_hashes_lock:
+        if len(_file_hashes) >= RESPONSE_CACHE_MAX_ENTRIES:
+            _file_hashes.clear()
+        _file_hashes[key] = digest
+    return digest
+
+def cache_key(model, file_path, context, variant=""):
+    """Bucket of interchangeable answers: same model, document bytes, retrieved context and output variant."""
+    context_hash = hashlib.sha256(context.encode("utf-8")).hexdigest()
+    return (model, document_hash(file_path), context_hash, variant)
+
+class _Entry:
+    __slots__ = ("bucket", "prompt", "vector", "response", "created", "size")
+
+    def __init__(self, bucket, prompt, vector, response):
+        self.bucket = bucket
+        self.prompt = prompt
+        self.vector = vector
+        self.response = response
+        self.created = time.monotonic()
+        self.size = vector.nbytes + len(prompt) + len(response) + 256
+
+class ResponseCache:
+    """Semantic LRU cache of LLM answers.
+
+    Answers are grouped by cache_key; within a bucket, a prompt hits when its
+    embedding is within the similarity threshold of a cached prompt. Entries
+    expire after ttl seconds and the least recently used go first once the
+    entry or byte limit is reached. Thread-safe.
+    """
+
+    def __init__(self, threshold=RESPONSE_CACHE_THRESHOLD, ttl=RESPONSE_CACHE_TTL,
+                 max_entries=RESPONSE_CACHE_MAX_ENTRIES, max_bytes=RESPONSE_CACHE_MAX_BYTES):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # id -> _Entry, least recently used first
+        self._buckets = {}  # cache key -> set of entry ids
+        self._bytes = 0
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def embed(self, prompt):
+        return normalize_vectors(get_embedding_service().encode([prompt]))[0]
+
+    def lookup(self, key, prompt, vector=None):
+        """Cached answer for a prompt in this bucket, or None."""
+        with self._lock:
+            candidates = self._live(key)
+        if not candidates:
+            self.misses += 1
+            return None
+        if vector is None:
+            vector = self.embed(prompt)
+        with self._lock:
+            best, best_score = None, self.threshold
+            for entry_id in candidates:
+                entry = self._entries.get(entry_id)
+                if entry is None:
+                    continue
+                score = 1.0 if entry.prompt == prompt else float(np.dot(entry.vector, vector))
+                if score >= best_score:
+                    best, best_score = entry_id, score
+            if best is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best)
+            self.hits += 1
+            return self._entries[best].response
+
+    def store(self, key, prompt, response, vector=None):
+        if vector is None:
+            vector = self.embed(prompt)
+        entry = _Entry(key, prompt, np.asarray(vector, dtype=np.float32), response)
+        if entry.size > self.max_bytes:
+            return
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = entry
+            self._buckets.setdefault(key, set()).add(entry_id)
+            self._bytes += entry.size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _live(self, key):
+        """Ids in a bucket, dropping expired entries on the way."""
+        ids = self._buckets.get(key)
+        if not ids:
+            return []
+        now = time.monotonic()
+        for entry_id in [i for i in ids if now - self._entries[i].created > self.ttl]:
+            self._remove(entry_id)
+        return list(self._buckets.get(key, ()))
+
+    def _remove(self, entry_id):
+        entry = self._entries.pop(entry_id)
+        self._bytes -= entry.size
+        ids = self._buckets[entry.bucket]
+        ids.discard(entry_id)
+        if not ids:
+            del self._buckets[entry.bucket]
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes, "hits": self.hits, "misses": self.misses}
+
+class _SharedStream:
+    """Frames of one upstream stream, kept so every waiter can replay them from the start."""
+
+    def __init__(self, frames):
+        self.frames = []
+        self.waiters = 0
+        self._changed = asyncio.Event()
+        self.task = asyncio.ensure_future(self._pump(frames))
+        self.task.add_done_callback(lambda _: self._notify())
+
+    async def _pump(self, frames):
+        async for frame in frames:
+            self.frames.append(frame)
+            self._notify()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wait(self):
+        await self._changed.wait()
+
+class RequestCoalescer:
+    """Runs one upstream call per identical in-flight request and fans the result out.
+
+    The shared call is cancelled only when every waiter has gone away.
+    """
+
+    def __init__(self):
+        self._inflight = {}  # key -> [task, waiter count]
+        self._streams = {}  # key -> _SharedStream
+
+    async def run(self, key, make_coro):
+        slot = self._inflight.get(key)
+        if slot is None:
+            task = asyncio.ensure_future(make_coro())
+            slot = self._inflight[key] = [task, 0]
+            task.add_done_callback(lambda _: self._inflight.pop(key, None) if self._inflight.get(key) is slot else None)
+        else:
+            logging.info("Joined an identical in-flight request")
+        slot[1] += 1
+        try:
+            return await asyncio.shield(slot[0])
+        finally:
+            slot[1] -= 1
+            if slot[1] == 0 and not slot[0].done():
+                slot[0].cancel()
+
+    async def stream(self, key, make_frames):
+        """Frames of one shared make_frames() stream per identical in-flight request.
+
+        A waiter that joins late first gets the frames it missed, so each one
+        sees the whole answer.
+        """
+        shared = self._streams.get(key)
+        if shared is None:
+            shared = self._streams[key] = _SharedStream(make_frames())
+            shared.task.add_done_callback(
+                lambda _: self._streams.pop(key, None) if self._streams.get(key) is shared else None)
+        else:
+            logging.info("Joined an identical in-flight stream")
+        shared.waiters += 1
+        try:
+            position = 0
+            while True:
+                while position < len(shared.frames):
+                    yield shared.frames[position]
+                    position += 1
+                if shared.task.done():
+                    shared.task.result()  # re-raise what ended the upstream stream
+                    return
+                await shared.wait()
+        finally:
+            shared.waiters -= 1
+            if shared.waiters == 0 and not shared.task.done():
+                shared.task.cancel()
+
+_cache = None
+_coalescers = weakref.WeakKeyDictionary()
+
+def get_response_cache():
+    """Return the process-wide response cache, or None when it is disabled."""
+    global _cache
+    if _cache is None and RESPONSE_CACHE_ENABLED:
+        _cache = ResponseCache()
+    return _cache
+
+def get_coalescer():
+    """Return the request coalescer of the running event loop."""
+    loop = asyncio.get_running_loop()
+    coalescer = _coalescers.get(loop)
+    if coalescer is None:
+        coalescer = _coalescers[loop] = RequestCoalescer()
+    return coalescer
@@ -0,0 +1,141 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import os
+import time
+import weakref
+from contextlib import asynccontextmanager
+from ollama_pool import OLLAMA_URLS
+
+# Generation admission settings (override through the environment). Concurrency
+# limits are per Ollama backend and scale with the number of OLLAMA_URLS. They are
+# for the whole server: each of its SERVER_WORKERS processes gets an equal share.
+SCHEDULER_MAX_CONCURRENCY = int(os.environ.get("SCHEDULER_MAX_CONCURRENCY", "2"))
+# Per-model overrides, e.g. "deepseek-r1:1.5b=4,llama3:8b=1"
+SCHEDULER_MODEL_CONCURRENCY = os.environ.get("SCHEDULER_MODEL_CONCURRENCY", "")
+SCHEDULER_MAX_QUEUE = int(os.environ.get("SCHEDULER_MAX_QUEUE", "32"))
+# Starting guess for a generation's duration, refined as requests complete
+SCHEDULER_INITIAL_SERVICE_SECONDS = float(os.environ.get("SCHEDULER_INITIAL_SERVICE_SECONDS", "10"))
+SERVER_WORKERS = max(1, int(os.environ.get("SERVER_WORKERS", "1")))
+
+# Lower values are served first
+INTERACTIVE = 0
+BULK = 1
+
+class SchedulerBusy(Exception):
+    """Raised when the generation queue is full."""
+
+def model_concurrency(model):
+    """Concurrency limit for a model, from SCHEDULER_MODEL_CONCURRENCY or the default."""
+    for item in SCHEDULER_MODEL_CONCURRENCY.split(","):
+        name, _, limit = item.rpartition("=")
+        if name.strip() == model and limit.strip().isdigit():
+            return int(limit)
+    return SCHEDULER_MAX_CONCURRENCY
+
+def worker_share(limit):
+    """This server worker's part of a server-wide limit; at least 1."""
+    return max(1, limit // SERVER_WORKERS)
+
+class GenerationScheduler:
+    """Admission control for one model: a concurrency limit and a bounded priority queue.
+
+    Interactive requests are admitted before bulk ones; within a priority, first
+    come first served. Callers waiting in the queue are told their position and
+    estimated wait whenever it changes.
+    """
+
+    def __init__(self, max_concurrency=SCHEDULER_MAX_CONCURRENCY, max_queue=SCHEDULER_MAX_QUEUE):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.running = 0
+        self._queue = []  # heap of (priority, sequence, waiter)
+        self._sequence = itertools.count()
+        self._service_seconds = SCHEDULER_INITIAL_SERVICE_SECONDS
+
+    def estimated_wait(self, position):
+        """Seconds until the request at this queue position (1-based) should start."""
+        return math.ceil(position / self.max_concurrency) * self._service_seconds
+
+    def _waiters(self):
+        return sorted(entry for entry in self._queue if not entry[2]["future"].done())
+
+    def _notify_positions(self):
+        for position, (_, _, waiter) in enumerate(self._waiters(), start=1):
+            if waiter["on_queued"] and waiter["position"] != position:
+                waiter["position"] = position
+                waiter["notices"].put_nowait((position, self.estimated_wait(position)))
+
+    def _release(self, seconds):
+        self.running -= 1
+        # Exponentially weighted average keeps the wait estimate current
+        self._service_seconds = 0.8 * self._service_seconds + 0.2 * seconds
+        while self._queue and self.running < self.max_concurrency:
+            _, _, waiter = heapq.heappop(self._queue)
+            if not waiter["future"].done():
+                self.running += 1
+                waiter["future"].set_result(None)
+        self._notify_positions()
+
+    @asynccontextmanager
+    async def slot(self, priority=INTERACTIVE, on_queued=None):
+        """Hold one of the model's generation slots for the duration of the block.
+
+        on_queued(position, estimated_wait_seconds) is awaited while the request
+        waits. Raises SchedulerBusy at once if the queue is already full.
+        """
+        if self.running < self.max_concurrency and not self._waiters():
+            self.running += 1
+        else:
+            if len(self._waiters()) >= self.max_queue:
+                raise SchedulerBusy(f"{len(self._queue)} requests already queued")
+            waiter = {"future": asyncio.get_running_loop().create_future(), "on_queued": on_queued,
+                      "position": None, "notices": asyncio.Queue()}
+            heapq.heappush(self._queue, (priority, next(self._sequence), waiter))
+            self._notify_positions()
+            try:
+                await self._wait(waiter)
+            except asyncio.CancelledError:
+                if waiter["future"].done() and not waiter["future"].cancelled():
+                    # Admitted just as we were cancelled: hand the slot on
+                    self._release(self._service_seconds)
+                else:
+                    waiter["future"].cancel()
+                    self._notify_positions()
+                raise
+
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(time.monotonic() - started)
+
+    async def _wait(self, waiter):
+        future = waiter["future"]
+        while not future.done():
+            notice = asyncio.ensure_future(waiter["notices"].get())
+            await asyncio.wait({future, notice}, return_when=asyncio.FIRST_COMPLETED)
+            if notice.done():
+                try:
+                    await waiter["on_queued"](*notice.result())
+                except Exception as e:
+                    logging.error(f"Error reporting queue position: {e}")
+            else:
+                notice.cancel()
+        await future
+
+    def stats(self):
+        return {"running": self.running, "queued": len(self._waiters()),
+                "max_concurrency": self.max_concurrency, "service_seconds": round(self._service_seconds, 2)}
+
+_schedulers = weakref.WeakKeyDictionary()  # event loop -> {model: GenerationScheduler}
+
+def get_scheduler(model):
+    """Return the scheduler for a model on the running event loop."""
+    per_loop = _schedulers.setdefault(asyncio.get_running_loop(), {})
+    if model not in per_loop:
+        per_loop[model] = GenerationScheduler(worker_share(model_concurrency(model) * len(OLLAMA_URLS)),
+                                              worker_share(SCHEDULER_MAX_QUEUE))
+    return per_loop[model]
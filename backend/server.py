@@ -1,11 +1,39 @@
+import os
 import uvicorn
-from websock import app
+
+# Which server module to run: websock:app (plain text replies) or back:app (JSON replies)
+SERVER_APP = os.environ.get("SERVER_APP", "websock:app")
+# Worker processes; above 1 the server runs without reload and the workers share
+# the on-disk vector store and uploads (see vector_store.VectorStore). Each worker
+# still loads its own embedding model: uvicorn starts workers as fresh processes,
+# so nothing loaded here could be inherited, and the model's memory grows with N.
+SERVER_WORKERS = int(os.environ.get("SERVER_WORKERS", "1"))
+
+def share_cores(workers):
+    """Split the machine between workers unless sizes were set explicitly.
+
+    Each worker has its own extraction processes, torch threads and generation
+    scheduler; left at their per-machine defaults, N workers would oversubscribe
+    the cores and the Ollama backends N times.
+    """
+    # The schedulers divide their limits by this (see scheduler.worker_share)
+    os.environ["SERVER_WORKERS"] = str(workers)
+    per_worker = str(max(1, (os.cpu_count() or 1) // workers))
+    os.environ.setdefault("WORKER_PROCESSES", per_worker)
+    os.environ.setdefault("EMBEDDING_THREADS", per_worker)
 
 if __name__ == "__main__":
-    uvicorn.run(
-        "websock:app",
-        host="0.0.0.0",
-        port=8000,
-        reload=True,
-        log_level="info"
-    )
\ No newline at end of file
+    if SERVER_WORKERS > 1:
+        share_cores(SERVER_WORKERS)
+        uvicorn.run(SERVER_APP, host="0.0.0.0", port=8000, workers=SERVER_WORKERS, log_level="info")
+    else:
+        # Both apps come from app_factory.create_app. Heavy models load in its lifespan
+        # hook, off the import path, so a reload only re-imports the light modules.
+        uvicorn.run(
+            SERVER_APP,
+            host="0.0.0.0",
+            port=8000,
+            reload=True,
+            reload_dirs=[os.path.dirname(os.path.abspath(__file__))],
+            log_level="info"
+        )
@@ -0,0 +1,138 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from prompt_packer import CONTEXT_WINDOW_TOKENS
+from streaming import strip_thinking
+from vector_store import get_vector_store
+
+# Conversation session settings (override through the environment)
+SESSION_IDLE_SECONDS = float(os.environ.get("SESSION_IDLE_SECONDS", "1800"))
+SESSION_MAX_BYTES = int(os.environ.get("SESSION_MAX_BYTES", str(256 * 1024 ** 2)))
+# Turns replayed as text when there is no Ollama context to continue from
+SESSION_HISTORY_TURNS = int(os.environ.get("SESSION_HISTORY_TURNS", "6"))
+# num_ctx sent to Ollama with every request, one value so the model is never reloaded. Each
+# turn is packed into CONTEXT_WINDOW_TOKENS; the rest of the window holds the conversation
+SESSION_NUM_CTX = int(os.environ.get("SESSION_NUM_CTX", str(2 * CONTEXT_WINDOW_TOKENS)))
+# Past this many tokens the Ollama context is dropped and recent history replayed instead;
+# by default whatever still leaves room for a fully packed turn
+SESSION_MAX_CONTEXT_TOKENS = int(os.environ.get(
+    "SESSION_MAX_CONTEXT_TOKENS", str(max(SESSION_NUM_CTX - CONTEXT_WINDOW_TOKENS, 0))))
+SESSION_MAX_TURNS = 100
+
+class Session:
+    """Conversation state of one client between turns.
+
+    Holds the chat history, the `context` token array Ollama returned for the
+    last turn (so a follow-up continues from it instead of re-sending the
+    conversation), the backend that served it, and the index handles of the
+    documents discussed.
+    """
+
+    def __init__(self, session_id=None):
+        self.id = session_id or uuid.uuid4().hex
+        self.history = []  # (prompt, answer)
+        self.context = []  # Ollama token ids for the conversation so far
+        self.backend = None  # URL of the backend holding the KV cache for context
+        self.documents = {}  # (path, size, mtime_ns) -> StoredDocument
+        self.last_used = time.monotonic()
+        self.lock = threading.Lock()
+
+    def touch(self):
+        self.last_used = time.monotonic()
+
+    @property
+    def size(self):
+        """Approximate bytes held; mapped document indexes are shared and not counted."""
+        text = sum(len(prompt) + len(answer) for prompt, answer in self.history)
+        return 1024 + 8 * len(self.context) + 2 * text
+
+    def load_document(self, file_path, loader):
+        """loader(file_path), remembered while the file is unchanged and still stored.
+
+        Reusing the remembered copy touches its vector store entry, so documents a
+        conversation keeps asking about are not the first evicted.
+        """
+        stat = os.stat(file_path)
+        key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+        with self.lock:
+            document = self.documents.get(key)
+        if document is not None and not get_vector_store().touch(document.key):
+            document = None
+        if document is None:
+            document = loader(file_path)
+            if document is not None:
+                with self.lock:
+                    self.documents[key] = document
+        return document
+
+    def add_turn(self, prompt, answer, context=None, backend=None):
+        with self.lock:
+            # The reasoning is not part of the conversation a replay should carry
+            self.history.append((prompt, strip_thinking(answer)))
+            del self.history[:-SESSION_MAX_TURNS]
+            self.context = list(context) if context else []
+            self.backend = backend if context else None
+        self.touch()
+
+    def reset_context(self):
+        with self.lock:
+            self.context = []
+            self.backend = None
+
+    def recent_history(self, turns=SESSION_HISTORY_TURNS):
+        """The last turns as plain text, for prompts that cannot use the context array."""
+        with self.lock:
+            recent = self.history[-turns:]
+        return "\n".join(f"User: {prompt}\nAssistant: {answer}" for prompt, answer in recent)
+
+class SessionStore:
+    """Sessions by id, evicted when idle or least recently used beyond a memory cap."""
+
+    def __init__(self, idle_seconds=SESSION_IDLE_SECONDS, max_bytes=SESSION_MAX_BYTES):
+        self.idle_seconds = idle_seconds
+        self.max_bytes = max_bytes
+        self._sessions = OrderedDict()  # id -> Session, least recently used first
+        self._lock = threading.Lock()
+
+    def get(self, session_id=None):
+        """The session with this id, created if it does not exist (or was evicted)."""
+        with self._lock:
+            self._evict()
+            session = self._sessions.get(session_id) if session_id else None
+            if session is None:
+                session = Session(session_id)
+                self._sessions[session.id] = session
+            self._sessions.move_to_end(session.id)
+            session.touch()
+            return session
+
+    def drop(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def _evict(self):
+        now = time.monotonic()
+        for session_id in [s.id for s in self._sessions.values() if now - s.last_used > self.idle_seconds]:
+            del self._sessions[session_id]
+            logging.info(f"Evicted idle session {session_id}")
+        total = sum(s.size for s in self._sessions.values())
+        while total > self.max_bytes and len(self._sessions) > 1:
+            _, session = self._sessions.popitem(last=False)
+            total -= session.size
+            logging.info(f"Evicted session {session.id} to stay under the memory cap")
+
+    def stats(self):
+        with self._lock:
+            return {"sessions": len(self._sessions), "bytes": sum(s.size for s in self._sessions.values())}
+
+_store = None
+
+def get_session_store():
+    """Return the process-wide session store."""
+    global _store
+    if _store is None:
+        _store = SessionStore()
+    return _store
@@ -0,0 +1,49 @@
+THINK_OPEN = "<think>"
+THINK_CLOSE = "</think>"
+
+class ThinkFilter:
+    """Removes <think>...</think> blocks from a stream of text deltas.
+
+    Tags may be split across deltas, so a trailing fragment that could be the
+    start of a tag is held back until the next delta decides it.
+    """
+
+    def __init__(self):
+        self.thinking = False
+        self._pending = ""
+
+    def feed(self, delta):
+        """Visible part of delta."""
+        text = self._pending + delta
+        self._pending = ""
+        visible = []
+        while text:
+            tag = THINK_CLOSE if self.thinking else THINK_OPEN
+            position = text.find(tag)
+            if position >= 0:
+                if not self.thinking:
+                    visible.append(text[:position])
+                text = text[position + len(tag):]
+                self.thinking = not self.thinking
+                continue
+            # Hold back a suffix that is a prefix of the tag
+            keep = 0
+            for size in range(min(len(tag) - 1, len(text)), 0, -1):
+                if tag.startswith(text[-size:]):
+                    keep = size
+                    break
+            if not self.thinking:
+                visible.append(text[:len(text) - keep])
+            self._pending = text[len(text) - keep:]
+            break
+        return "".join(visible)
+
+    def flush(self):
+        """Whatever was held back at the end of the stream."""
+        text, self._pending = self._pending, ""
+        return "" if self.thinking else text
+
+def strip_thinking(text):
+    """text with its <think> blocks removed."""
+    think_filter = ThinkFilter()
+    return (think_filter.feed(text) + think_filter.flush()).strip()
@@ -0,0 +1,301 @@
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+import pandas as pd  # CSV and XLSX handling
+from response_cache import document_hash
+from tabular import TABULAR_READ_CHUNKSIZE
+
+# Tabular answer engine settings (override through the environment)
+TABLE_CACHE_MAX_BYTES = int(os.environ.get("TABLE_CACHE_MAX_BYTES", str(512 * 1024 ** 2)))
+# Larger files are left to retrieval without being read; smaller ones still are once
+# their parsed frame passes TABLE_CACHE_MAX_BYTES
+TABLE_QA_MAX_FILE_BYTES = int(os.environ.get("TABLE_QA_MAX_FILE_BYTES", str(TABLE_CACHE_MAX_BYTES)))
+TABLE_QA_MAX_ROWS = 50
+# Files found too large to load are remembered so they are not read again on every question
+TABLE_TOO_LARGE_HISTORY = 1000
+# Text columns with at most this many distinct values become categoricals and can be filtered by value
+CATEGORY_MAX_UNIQUE = 1000
+
+AGGREGATES = [
+    ("sum", re.compile(r"\b(total|sum)\b")),
+    ("mean", re.compile(r"\b(average|mean|avg)\b")),
+    ("max", re.compile(r"\b(max|maximum|highest|largest|most)\b")),
+    ("min", re.compile(r"\b(min|minimum|lowest|smallest|least)\b")),
+    ("count", re.compile(r"\b(count|how many|number of)\b")),
+]
+TOP_N_RE = re.compile(r"\b(top|bottom|highest|lowest|largest|smallest)\s+(\d+)\b")
+COMPARISONS = {
+    ">=": "ge", "<=": "le", ">": "gt", "<": "lt", "=": "eq", "==": "eq", "is": "eq", "equals": "eq",
+    "above": "gt", "over": "gt", "greater than": "gt", "more than": "gt",
+    "below": "lt", "under": "lt", "less than": "lt",
+}
+OP_SYMBOLS = {"eq": "=", "gt": ">", "ge": ">=", "lt": "<", "le": "<="}
+
+class TableTooLarge(Exception):
+    """Raised when a table's frame would not fit the cache budget."""
+
+class TableCache:
+    """LRU cache of parsed tables in columnar form, bounded by their memory use.
+
+    A table whose frame would not fit the budget is never loaded whole: the
+    read stops as soon as it passes the budget and the file is remembered, so
+    questions about it go straight to retrieval.
+    """
+
+    def __init__(self, max_bytes=TABLE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._frames = OrderedDict()  # key -> (DataFrame, bytes)
+        self._too_large = OrderedDict()  # keys of tables over the budget
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, file_path):
+        """The file's frame; raises TableTooLarge if it would not fit the cache."""
+        key = document_hash(file_path)
+        with self._lock:
+            if key in self._too_large:
+                raise TableTooLarge(file_path)
+            if key in self._frames:
+                self._frames.move_to_end(key)
+                return self._frames[key][0]
+        try:
+            frame = load_table(file_path, self.max_bytes)
+        except TableTooLarge:
+            with self._lock:
+                self._too_large[key] = True
+                if len(self._too_large) > TABLE_TOO_LARGE_HISTORY:
+                    self._too_large.popitem(last=False)
+            raise
+        size = int(frame.memory_usage(deep=True).sum())
+        with self._lock:
+            self._frames[key] = (frame, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted) = self._frames.popitem(last=False)
+                self._bytes -= evicted
+        return frame
+
+def iter_table_frames(file_path, chunksize=TABULAR_READ_CHUNKSIZE):
+    """Yield a CSV, or an XLSX's first sheet, as frames of chunksize rows."""
+    if not file_path.lower().endswith(".xlsx"):
+        yield from pd.read_csv(file_path, chunksize=chunksize)
+        return
+    from openpyxl import load_workbook  # XLSX handling
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        columns, rows = None, []
+        for values in workbook.worksheets[0].iter_rows(values_only=True):
+            if columns is None:
+                if any(value is not None for value in values):
+                    columns = [str(v) if v is not None else f"column{i + 1}" for i, v in enumerate(values)]
+                continue
+            rows.append(values[:len(columns)])
+            if len(rows) >= chunksize:
+                yield pd.DataFrame(rows, columns=columns)
+                rows = []
+        if rows:
+            yield pd.DataFrame(rows, columns=columns)
+    finally:
+        workbook.close()
+
+def load_table(file_path, max_bytes=TABLE_CACHE_MAX_BYTES):
+    """Read a CSV/XLSX into a compact frame: numeric columns as numbers, repetitive text as categoricals.
+
+    The file is read in chunks; raises TableTooLarge as soon as they pass max_bytes.
+    """
+    parts, size = [], 0
+    for part in iter_table_frames(file_path):
+        size += int(part.memory_usage(deep=True).sum())
+        if size > max_bytes:
+            raise TableTooLarge(file_path)
+        parts.append(part)
+    frame = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame()
+    del parts
+    frame.columns = [str(column).strip() for column in frame.columns]
+    for column in frame.columns:
+        if frame[column].dtype == object or pd.api.types.is_string_dtype(frame[column]):
+            numeric = pd.to_numeric(frame[column], errors="coerce")
+            if numeric.notna().sum() >= 0.9 * frame[column].notna().sum() > 0:
+                frame[column] = numeric
+            elif frame[column].nunique() <= CATEGORY_MAX_UNIQUE:
+                frame[column] = frame[column].astype("category")
+    return frame
+
+def _normalize(text):
+    return re.sub(r"[_\-\s]+", " ", text.lower()).strip()
+
+class TableQuery:
+    """A structured reading of a question: aggregate, top-N and filters."""
+
+    def __init__(self):
+        self.aggregate = None  # sum, mean, max, min or count
+        self.metric = None  # numeric column aggregated or ranked
+        self.group_by = None
+        self.top_n = None
+        self.ascending = False
+        self.filters = []  # (column, op, value)
+
+    def add_filter(self, column, op, value):
+        """Add a filter unless the prompt already gave it (matched both as a comparison and as a value)."""
+        for existing in self.filters:
+            if existing[:2] == (column, op) and str(existing[2]).lower() == str(value).lower():
+                return
+        self.filters.append((column, op, value))
+
+    def describe(self):
+        parts = []
+        if self.top_n and self.group_by:
+            order = "lowest" if self.ascending else "highest"
+            if self.top_n == 1:
+                parts.append(f"{self.group_by} with the {order} {self.aggregate} of {self.metric}")
+            else:
+                parts.append(f"{self.top_n} {self.group_by} values with the {order} {self.aggregate} of {self.metric}")
+        elif self.top_n == 1:
+            parts.append(f"row with the {'lowest' if self.ascending else 'highest'} {self.metric}")
+        elif self.top_n:
+            parts.append(f"{'bottom' if self.ascending else 'top'} {self.top_n} rows by {self.metric}")
+        elif self.aggregate:
+            parts.append(f"{self.aggregate} of {self.metric or 'rows'}")
+            if self.group_by:
+                parts.append(f"by {self.group_by}")
+        for column, op, value in self.filters:
+            parts.append(f"where {column} {OP_SYMBOLS[op]} {value}")
+        return " ".join(parts)
+
+    def fields(self):
+        """The reading spelled out field by field, so a misread question is easy to spot."""
+        fields = [f"aggregate={self.aggregate or 'none'}", f"metric={self.metric or 'none'}"]
+        if self.group_by:
+            fields.append(f"group_by={self.group_by}")
+        if self.top_n:
+            fields.append(f"{'bottom' if self.ascending else 'top'}={self.top_n}")
+        filters = ", ".join(f"{column} {OP_SYMBOLS[op]} {value}" for column, op, value in self.filters)
+        fields.append(f"filters={filters or 'none'}")
+        return "; ".join(fields)
+
+def detect_intent(frame, prompt):
+    """Parse aggregate, filter and top-N intents from a prompt; None if there are none."""
+    text = _normalize(prompt)
+    names = {_normalize(column): column for column in frame.columns}
+    pattern = "|".join(re.escape(name) for name in sorted(names, key=len, reverse=True))
+    if not pattern:
+        return None
+    mentioned = [names[m.group(0)] for m in re.finditer(rf"\b(?:{pattern})\b", text)]
+    numeric = [c for c in mentioned if pd.api.types.is_numeric_dtype(frame[c])]
+    query = TableQuery()
+
+    group = re.search(rf"\b(?:by|per|for each|across|grouped by)\s+(?:the\s+)?({pattern})\b", text)
+    if group:
+        query.group_by = names[group.group(1)]
+
+    comparison_words = "|".join(re.escape(w) for w in sorted(COMPARISONS, key=len, reverse=True))
+    for m in re.finditer(rf"\b({pattern})\s*({comparison_words})\s*([\w.]+)", text):
+        column, op, value = names[m.group(1)], COMPARISONS[m.group(2)], m.group(3)
+        if pd.api.types.is_numeric_dtype(frame[column]):
+            try:
+                query.add_filter(column, op, float(value))
+            except ValueError:
+                continue
+        elif op == "eq":
+            query.add_filter(column, op, value)
+    # Category values named in the prompt ("revenue in the north region") filter too
+    for column in frame.columns:
+        if column == query.group_by or not isinstance(frame[column].dtype, pd.CategoricalDtype):
+            continue
+        for value in frame[column].cat.categories:
+            normalized = _normalize(str(value))
+            if len(normalized) > 1 and re.search(rf"\b{re.escape(normalized)}\b", text) and normalized not in names:
+                query.add_filter(column, "eq", str(value))
+
+    metric_candidates = [c for c in numeric if c != query.group_by and all(c != f[0] for f in query.filters)]
+    query.metric = metric_candidates[0] if metric_candidates else (numeric[0] if numeric else None)
+
+    top = TOP_N_RE.search(text)
+    if top and query.metric:
+        query.top_n = int(top.group(2))
+        query.ascending = top.group(1) in ("bottom", "lowest", "smallest")
+        return query
+    for name, regex in AGGREGATES:
+        if regex.search(text):
+            query.aggregate = name
+            break
+    # "Which region has the most revenue" asks for the region, not just the maximum
+    which = re.search(rf"\b(?:which|what)\s+({pattern})\b", text)
+    if which and names[which.group(1)] != query.metric and not query.group_by:
+        column = names[which.group(1)]
+        if query.aggregate in ("max", "min") and query.metric:
+            query.top_n, query.ascending = 1, query.aggregate == "min"
+            if frame[column].dropna().is_unique:
+                # One row per value: the answer is the row with the extreme metric
+                query.aggregate = None
+            else:
+                # Values repeat across rows: the one whose rows add up to the most
+                query.group_by, query.aggregate = column, "sum"
+            return query
+        if query.aggregate:
+            # "Which region has the highest total revenue": totals per region, largest first
+            query.group_by = names[which.group(1)]
+    if query.aggregate and (query.metric or query.aggregate == "count"):
+        return query
+    return None
+
+def _mask(frame, filters):
+    mask = pd.Series(True, index=frame.index)
+    for column, op, value in filters:
+        series = frame[column]
+        if op == "eq" and not pd.api.types.is_numeric_dtype(series):
+            mask &= series.astype(str).str.lower() == str(value).lower()
+        else:
+            mask &= getattr(series, op)(value)
+    return mask
+
+def run_query(frame, query):
+    """Compute the query with vectorized pandas operations; returns a small frame."""
+    selected = frame[_mask(frame, query.filters)] if query.filters else frame
+    if query.top_n and not query.group_by:
+        ranked = selected.nsmallest if query.ascending else selected.nlargest
+        return ranked(query.top_n, query.metric)
+    if query.aggregate == "count":
+        if query.group_by:
+            return selected.groupby(query.group_by, observed=True).size().rename("count").reset_index()
+        return pd.DataFrame({"count": [len(selected)]})
+    if query.group_by:
+        result = selected.groupby(query.group_by, observed=True)[query.metric].agg(query.aggregate).reset_index()
+        result = result.sort_values(query.metric, ascending=query.ascending)
+        return result.head(query.top_n) if query.top_n else result
+    return pd.DataFrame({f"{query.aggregate}({query.metric})": [selected[query.metric].agg(query.aggregate)]})
+
+_cache = TableCache()
+
+def answer_table_question(file_path, prompt):
+    """Answer aggregate/filter/top-N questions about a table directly.
+
+    Returns the result table for the prompt, headed by how the question was read
+    (columns, aggregate, filters) so the model can tell when it was misread, or
+    None when the question is not structured enough or the table too large to load.
+    """
+    try:
+        if os.path.getsize(file_path) > TABLE_QA_MAX_FILE_BYTES:
+            return None
+        frame = _cache.get(file_path)
+        query = detect_intent(frame, prompt)
+        if query is None:
+            return None
+        result = run_query(frame, query)
+    except TableTooLarge:
+        logging.info(f"{file_path} is too large to load for table questions; using retrieval only")
+        return None
+    except Exception as e:
+        logging.error(f"Error answering table question on {file_path}: {e}")
+        return None
+
+    logging.info(f"Table query on {file_path}: {query.describe()}")
+    shown = result.head(TABLE_QA_MAX_ROWS)
+    note = f" (first {TABLE_QA_MAX_ROWS} of {len(result)} rows)" if len(result) > TABLE_QA_MAX_ROWS else ""
+    return (
+        f"Question read as: {query.fields()}\n"
+        f"Computed {query.describe()} over {len(frame)} rows{note}:\n"
+        f"{shown.to_string(index=False)}"
+    )
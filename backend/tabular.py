@@ -0,0 +1,98 @@
+import os
+from chunking import Chunk, count_tokens, split_long_text, CHUNK_MAX_TOKENS
+
+# Rows read from a CSV at a time
+TABULAR_READ_CHUNKSIZE = int(os.environ.get("TABULAR_READ_CHUNKSIZE", "10000"))
+
+TABULAR_CATEGORIES = ["csv", "xlsx"]
+
+def format_row(columns, values):
+    """Compact `column=value` record of one row, skipping empty cells."""
+    return "; ".join(
+        f"{column}={value}" for column, value in zip(columns, values)
+        if value is not None and value != ""
+    )
+
+def iter_csv_rows(file_path, chunksize=TABULAR_READ_CHUNKSIZE):
+    """Yield (sheet_number, row_number, record) for a CSV, reading chunksize rows at a time."""
+    import pandas as pd  # CSV handling
+    row_number = 0
+    for frame in pd.read_csv(file_path, chunksize=chunksize, dtype=str, keep_default_na=False):
+        columns = [str(column) for column in frame.columns]
+        for values in frame.itertuples(index=False, name=None):
+            row_number += 1
+            record = format_row(columns, values)
+            if record:
+                yield 1, row_number, record
+
+def iter_xlsx_rows(file_path):
+    """Yield (sheet_number, row_number, record) for every sheet, streaming in read-only mode.
+
+    The first non-empty row of each sheet is its header.
+    """
+    from openpyxl import load_workbook  # XLSX handling
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        for sheet_number, sheet in enumerate(workbook.worksheets, start=1):
+            columns = None
+            for row_number, values in enumerate(sheet.iter_rows(values_only=True), start=1):
+                if columns is None:
+                    if any(value is not None for value in values):
+                        columns = [str(v) if v is not None else f"column{i + 1}" for i, v in enumerate(values)]
+                    continue
+                record = format_row(columns, values)
+                if record:
+                    yield sheet_number, row_number, record
+    finally:
+        workbook.close()
+
+def iter_table_rows(file_path):
+    """Row records of a CSV or XLSX file."""
+    if file_path.lower().endswith(".xlsx"):
+        return iter_xlsx_rows(file_path)
+    return iter_csv_rows(file_path)
+
+def split_record(record, max_tokens):
+    """Pieces of a row record of at most max_tokens each, cut between fields where possible."""
+    fields = []
+    for field in record.split("; "):
+        if count_tokens(field) > max_tokens:
+            fields.extend(text for text, _, _ in split_long_text(field, 0, max_tokens))
+        else:
+            fields.append(field)
+    piece, tokens = [], 0
+    for field in fields:
+        field_tokens = count_tokens(field)
+        # The "; " joining two fields counts as one token
+        if piece and tokens + 1 + field_tokens > max_tokens:
+            yield "; ".join(piece)
+            piece, tokens = [], 0
+        tokens += field_tokens + (1 if piece else 0)
+        piece.append(field)
+    if piece:
+        yield "; ".join(piece)
+
+def iter_row_chunks(rows, max_tokens=CHUNK_MAX_TOKENS):
+    """Group consecutive row records of a sheet into chunks of at most max_tokens.
+
+    A record longer than max_tokens is split over several chunks. For table
+    chunks, start/end are the first and one-past-last row numbers and page is
+    the sheet number.
+    """
+    lines, tokens, first, last, sheet = [], 0, None, None, None
+    for sheet_number, row_number, record in rows:
+        pieces = [record]
+        if count_tokens(record) > max_tokens:
+            pieces = split_record(record, max_tokens)
+        for piece in pieces:
+            piece_tokens = count_tokens(piece)
+            if lines and (sheet_number != sheet or tokens + piece_tokens > max_tokens):
+                yield Chunk("\n".join(lines), first, last + 1, sheet)
+                lines, tokens = [], 0
+            if not lines:
+                first, sheet = row_number, sheet_number
+            lines.append(piece)
+            tokens += piece_tokens
+            last = row_number
+    if lines:
+        yield Chunk("\n".join(lines), first, last + 1, sheet)
@@ -0,0 +1,348 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+import uuid
+import weakref
+from collections import OrderedDict
+from python_multipart.multipart import MultipartParser, parse_options_header
+from main import async_send_request, categorize_file, load_document_index, INDEXED_CATEGORIES, UNSUPPORTED_MESSAGE
+from prompt_packer import SMALL_FILE_BYTES
+from scheduler import BULK
+
+# Upload settings (override through the environment)
+UPLOAD_DIR = os.environ.get("UPLOAD_DIR", "uploads")
+UPLOAD_MAX_BYTES = int(os.environ.get("UPLOAD_MAX_BYTES", str(512 * 1024 ** 2)))
+UPLOAD_CHUNK_BYTES = int(os.environ.get("UPLOAD_CHUNK_BYTES", str(1024 ** 2)))
+# Limit on each non-file form field (the question); also the allowance for multipart framing
+UPLOAD_FIELD_MAX_BYTES = int(os.environ.get("UPLOAD_FIELD_MAX_BYTES", str(64 * 1024)))
+# Uploaded files are kept this long after their job ends so follow-up questions can use them
+UPLOAD_RETENTION_SECONDS = float(os.environ.get("UPLOAD_RETENTION_SECONDS", "3600"))
+UPLOAD_WORKERS = int(os.environ.get("UPLOAD_WORKERS", "2"))
+# Minimum spacing of progress events for one job; stage changes are always sent
+JOB_PROGRESS_INTERVAL = float(os.environ.get("JOB_PROGRESS_INTERVAL", "0.5"))
+JOB_HISTORY = 1000
+# Job states are mirrored here so any server worker can answer for any job
+JOB_STATE_DIR = os.path.join(UPLOAD_DIR, ".jobs")
+
+class UploadTooLarge(Exception):
+    """Raised when an upload exceeds UPLOAD_MAX_BYTES."""
+
+async def receive_upload(request, file_field="file", directory=UPLOAD_DIR, max_bytes=UPLOAD_MAX_BYTES,
+                         chunk_bytes=UPLOAD_CHUNK_BYTES):
+    """Stream a multipart/form-data request's file straight to disk, hashing it on the way.
+
+    An UploadFile parameter would have Starlette spool the whole body to a temp
+    file before the handler runs, so a cap checked afterwards limits nothing.
+    This reads the request stream itself: a Content-Length over the cap is
+    refused before any of the body is read, and a body without one is cut off
+    as soon as it passes the cap. The file is stored under its SHA-256, so
+    re-uploading a document reuses it; other parts are returned as form fields.
+    Returns (path, sha256, size, filename, fields); raises UploadTooLarge.
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise ValueError("Expected a multipart/form-data upload")
+    body_limit = max_bytes + UPLOAD_FIELD_MAX_BYTES
+    declared = request.headers.get("content-length", "")
+    if declared.isdigit() and int(declared) > body_limit:
+        raise UploadTooLarge(f"Upload exceeds {max_bytes} bytes")
+
+    part = {}
+    fields = {}
+    upload = {"filename": None, "size": 0, "found": False}
+    pending = bytearray()
+
+    def on_part_begin():
+        part.clear()
+        part.update(headers={}, header=b"", value=b"", data=bytearray(), is_file=False)
+
+    def on_header_field(data, start, end):
+        part["header"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        part["value"] += data[start:end]
+
+    def on_header_end():
+        part["headers"][part["header"].lower()] = part["value"]
+        part["header"] = part["value"] = b""
+
+    def on_headers_finished():
+        _, options = parse_options_header(part["headers"].get(b"content-disposition", b""))
+        part["name"] = options.get(b"name", b"").decode("utf-8", errors="replace")
+        filename = options.get(b"filename")
+        if filename is not None and part["name"] == file_field and not upload["found"]:
+            part["is_file"] = upload["found"] = True
+            upload["filename"] = filename.decode("utf-8", errors="replace")
+
+    def on_part_data(data, start, end):
+        if part["is_file"]:
+            upload["size"] += end - start
+            if upload["size"] > max_bytes:
+                raise UploadTooLarge(f"Upload exceeds {max_bytes} bytes")
+            pending.extend(data[start:end])
+        else:
+            part["data"].extend(data[start:end])
+            if len(part["data"]) > UPLOAD_FIELD_MAX_BYTES:
+                raise UploadTooLarge(f"Form field {part['name']!r} exceeds {UPLOAD_FIELD_MAX_BYTES} bytes")
+
+    def on_part_end():
+        if not part["is_file"]:
+            fields[part["name"]] = part["data"].decode("utf-8", errors="replace")
+
+    parser = MultipartParser(params[b"boundary"], {
+        "on_part_begin": on_part_begin, "on_header_field": on_header_field,
+        "on_header_value": on_header_value, "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished, "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = os.path.join(directory, f".{uuid.uuid4().hex}.part")
+    digest = hashlib.sha256()
+    received = 0
+    try:
+        with open(tmp_path, "wb") as out:
+            async for chunk in request.stream():
+                received += len(chunk)
+                if received > body_limit:
+                    raise UploadTooLarge(f"Upload exceeds {max_bytes} bytes")
+                parser.write(chunk)
+                # Written a chunk at a time, off the event loop
+                if len(pending) >= chunk_bytes:
+                    digest.update(pending)
+                    await asyncio.to_thread(out.write, bytes(pending))
+                    pending.clear()
+            parser.finalize()
+            digest.update(pending)
+            await asyncio.to_thread(out.write, bytes(pending))
+        if not upload["found"]:
+            raise ValueError(f"No {file_field!r} file in the upload")
+        extension = os.path.splitext(upload["filename"])[1].lower()
+        path = os.path.join(directory, digest.hexdigest() + extension)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return path, digest.hexdigest(), upload["size"], upload["filename"], fields
+
+def ingest_upload(file_path, on_progress=None):
+    """Prepare an uploaded file for questions; raises ValueError if it cannot be used.
+
+    Documents are indexed into the vector store. Small files and images are left
+    as they are: small files are read whole at question time (see
+    build_context) and images are OCR'd then.
+    """
+    category = categorize_file(file_path)
+    if category == "image" or (category in INDEXED_CATEGORIES and os.path.getsize(file_path) <= SMALL_FILE_BYTES):
+        return True
+    if category not in INDEXED_CATEGORIES:
+        raise ValueError(UNSUPPORTED_MESSAGE)
+    if load_document_index(file_path, on_progress=on_progress) is None:
+        raise ValueError("No text could be extracted from the file")
+    return True
+
+async def answer_upload(prompt, file_path):
+    return await async_send_request(prompt, file_path, priority=BULK)
+
+class IngestionJob:
+    """One uploaded document going through ingestion and, optionally, a question."""
+
+    def __init__(self, file_path, document_id, filename, prompt=None):
+        self.id = uuid.uuid4().hex
+        self.file_path = file_path
+        self.document_id = document_id
+        self.filename = filename
+        self.prompt = prompt
+        self.status = "queued"  # queued, running, done or failed
+        self.stage = None
+        self.progress = {}
+        self.response = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self.subscribers = set()  # async callables taking an event dict
+        self._last_event = 0.0
+
+    def describe(self):
+        return {
+            "job_id": self.id, "document_id": self.document_id, "filename": self.filename,
+            "file_path": self.file_path, "status": self.status, "stage": self.stage,
+            "progress": self.progress, "response": self.response, "error": self.error,
+        }
+
+class JobManager:
+    """Runs ingestion jobs on background workers and pushes their progress to subscribers.
+
+    `ingest(file_path, on_progress)` runs in a worker thread; `answer(prompt,
+    file_path)` is awaited afterwards for jobs that came with a question. Each
+    job's state is also written to state_dir, so with several server workers
+    a job can be looked up or followed from a worker other than its own.
+    """
+
+    def __init__(self, ingest=ingest_upload, answer=answer_upload, workers=UPLOAD_WORKERS,
+                 upload_dir=UPLOAD_DIR, state_dir=JOB_STATE_DIR):
+        self.ingest = ingest
+        self.answer = answer
+        self.upload_dir = upload_dir
+        self.state_dir = state_dir
+        os.makedirs(state_dir, exist_ok=True)
+        self.jobs = OrderedDict()
+        self._queue = asyncio.Queue()
+        self._loop = asyncio.get_running_loop()
+        self._workers = [self._loop.create_task(self._work()) for _ in range(workers)]
+
+    def submit(self, file_path, document_id, filename, prompt=None):
+        job = IngestionJob(file_path, document_id, filename, prompt)
+        self.jobs[job.id] = job
+        self._sweep()
+        self._save(job)
+        self._queue.put_nowait(job)
+        logging.info(f"Queued ingestion job {job.id} for {filename}")
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def status(self, job_id):
+        """A job's describe() dict, from this worker or another one's state file; None if unknown."""
+        job = self.jobs.get(job_id)
+        if job is not None:
+            return job.describe()
+        try:
+            with open(self._state_path(job_id), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    async def subscribe(self, job_id, send):
+        """Send a job's events to send(event); a finished job's final event is sent at once."""
+        job = self.jobs.get(job_id)
+        if job is None:
+            state = self.status(job_id) if job_id else None
+            if state is None:
+                await send({"type": "error", "job_id": job_id, "error": "Unknown job"})
+            else:
+                # Another worker runs it: relay its state file until it finishes
+                self._loop.create_task(self._follow(job_id, state, send))
+            return
+        job.subscribers.add(send)
+        await send(dict(job.describe(), type="progress" if job.finished is None else job.status))
+
+    async def _follow(self, job_id, state, send):
+        last = None
+        try:
+            while state is not None:
+                finished = state["status"] in ("done", "failed")
+                if state != last:
+                    await send(dict(state, type=state["status"] if finished else "progress"))
+                    last = state
+                if finished:
+                    return
+                await asyncio.sleep(JOB_PROGRESS_INTERVAL)
+                state = self.status(job_id)
+        except Exception as e:
+            logging.info(f"Stopped following job {job_id}: {e}")
+
+    def _state_path(self, job_id):
+        return os.path.join(self.state_dir, f"{os.path.basename(job_id)}.json")
+
+    def _save(self, job):
+        path = self._state_path(job.id)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(job.describe(), f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logging.error(f"Could not save state of job {job.id}: {e}")
+
+    def unsubscribe(self, send):
+        for job in self.jobs.values():
+            job.subscribers.discard(send)
+
+    async def _emit(self, job, event):
+        self._save(job)
+        event = dict(event, job_id=job.id)
+        for send in list(job.subscribers):
+            try:
+                await send(event)
+            except Exception:
+                job.subscribers.discard(send)
+
+    def _on_progress(self, job, stage, info):
+        # Called from the ingestion thread for every page and batch; throttled here
+        # so a large document does not flood the event loop or the sockets
+        changed = stage != job.stage
+        job.stage, job.progress = stage, info
+        now = time.monotonic()
+        if not changed and now - job._last_event < JOB_PROGRESS_INTERVAL:
+            return
+        job._last_event = now
+        event = {"type": "progress", "stage": stage, **info}
+        self._loop.call_soon_threadsafe(lambda: self._loop.create_task(self._emit(job, event)))
+
+    async def _work(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._run(job)
+            except Exception as e:
+                logging.error(f"Ingestion job {job.id} failed: {e}")
+                job.status, job.error = "failed", str(e)
+            job.finished = time.time()
+            await self._emit(job, dict(job.describe(), type=job.status))
+
+    async def _run(self, job):
+        job.status = "running"
+        await self._emit(job, {"type": "progress", "stage": "started"})
+        await asyncio.to_thread(self.ingest, job.file_path, lambda stage, info: self._on_progress(job, stage, info))
+        job.stage = "ingested"
+        if job.prompt:
+            await self._emit(job, {"type": "progress", "stage": "answering"})
+            job.response = await self.answer(job.prompt, job.file_path)
+        job.status = "done"
+
+    def _sweep(self):
+        """Forget old jobs and delete upload files no job needs any more."""
+        now = time.time()
+        for job_id in list(self.jobs):
+            job = self.jobs[job_id]
+            if job.finished is None:
+                continue
+            if now - job.finished >= UPLOAD_RETENTION_SECONDS or len(self.jobs) > JOB_HISTORY:
+                del self.jobs[job_id]
+                if os.path.exists(self._state_path(job_id)):
+                    os.remove(self._state_path(job_id))
+        in_use = {os.path.abspath(job.file_path) for job in self.jobs.values()
+                  if job.finished is None or now - job.finished < UPLOAD_RETENTION_SECONDS}
+        # Files are shared by every server worker; each upload rewrites its file and renews
+        # the mtime, so a file untouched for the retention period is no worker's any more
+        for entry in os.scandir(self.upload_dir):
+            if (entry.is_file() and not entry.name.startswith(".")
+                    and os.path.abspath(entry.path) not in in_use
+                    and now - entry.stat().st_mtime >= UPLOAD_RETENTION_SECONDS):
+                os.remove(entry.path)
+
+    async def close(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+
+_managers = weakref.WeakKeyDictionary()
+
+def get_job_manager():
+    """Return the job manager of the running event loop, starting its workers on first use."""
+    loop = asyncio.get_running_loop()
+    manager = _managers.get(loop)
+    if manager is None:
+        manager = _managers[loop] = JobManager()
+    return manager
+
+async def close_job_manager():
+    """Stop the running loop's ingestion workers; unfinished jobs are abandoned."""
+    manager = _managers.pop(asyncio.get_running_loop(), None)
+    if manager is not None:
+        await manager.close()
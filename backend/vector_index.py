@@ -0,0 +1,144 @@
+import logging
+import math
+import os
+import numpy as np
+
+# FAISS is imported where it is used, so importing this module (and the servers) stays cheap
+
+# Index selection settings (override through the environment)
+INDEX_TYPE = os.environ.get("INDEX_TYPE", "auto")  # auto, flat, ivf or hnsw
+INDEX_ANN_THRESHOLD = int(os.environ.get("INDEX_ANN_THRESHOLD", "50000"))
+INDEX_ANN_KIND = os.environ.get("INDEX_ANN_KIND", "ivf")  # index used by "auto" above the threshold
+DEFAULT_NPROBE = int(os.environ.get("INDEX_NPROBE", "16"))
+DEFAULT_EF_SEARCH = int(os.environ.get("INDEX_EF_SEARCH", "64"))
+# How vectors are stored in the index: float32, float16, int8 (scalar quantizer) or pq
+INDEX_STORAGE = os.environ.get("INDEX_STORAGE", "float32")
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+# PQ needs 256 centroids per sub-quantizer; below this many vectors fall back to int8
+PQ_MIN_VECTORS = 10000
+
+# index_factory codec for each storage mode
+STORAGE_CODECS = {"float32": "Flat", "float16": "SQfp16", "int8": "SQ8"}
+
+def index_settings():
+    """Settings that change how an index is built; part of the vector store key."""
+    return {
+        "metric": "cosine",
+        "type": INDEX_TYPE,
+        "ann_threshold": INDEX_ANN_THRESHOLD,
+        "ann_kind": INDEX_ANN_KIND,
+        "storage": INDEX_STORAGE,
+    }
+
+def normalize_vectors(vectors):
+    """Return an L2-normalized float32 copy so inner product equals cosine similarity."""
+    import faiss  # vector search
+    vectors = np.array(vectors, dtype=np.float32, copy=True)
+    if len(vectors):
+        faiss.normalize_L2(vectors)
+    return vectors
+
+def choose_index_type(num_vectors, index_type=None):
+    """Pick flat for small corpora and an ANN index above INDEX_ANN_THRESHOLD."""
+    index_type = index_type or INDEX_TYPE
+    if index_type != "auto":
+        return index_type
+    return "flat" if num_vectors < INDEX_ANN_THRESHOLD else INDEX_ANN_KIND
+
+def ivf_nlist(num_vectors):
+    """Number of IVF lists: about 4*sqrt(n), with at least 39 training points per list."""
+    return max(1, min(int(4 * math.sqrt(num_vectors)), num_vectors // 39))
+
+def pq_subquantizers(dimension):
+    """Largest divisor of the dimension giving sub-vectors of at least 8 dimensions."""
+    for m in range(dimension // 8, 0, -1):
+        if dimension % m == 0:
+            return m
+    return 1
+
+def storage_codec(dimension, num_vectors, storage=None):
+    """index_factory codec for a storage mode, e.g. "SQ8" or "PQ48x8"."""
+    storage = storage or INDEX_STORAGE
+    if storage == "pq":
+        if num_vectors >= PQ_MIN_VECTORS:
+            return f"PQ{pq_subquantizers(dimension)}x8"
+        logging.info(f"{num_vectors} vectors are too few to train PQ; storing them as int8")
+        storage = "int8"
+    if storage not in STORAGE_CODECS:
+        raise ValueError(f"Unknown index storage: {storage}")
+    return STORAGE_CODECS[storage]
+
+def index_description(kind, dimension, num_vectors, storage=None):
+    """index_factory string for an index type and storage mode."""
+    codec = storage_codec(dimension, num_vectors, storage)
+    if kind == "flat":
+        return codec
+    if kind == "ivf":
+        return f"IVF{ivf_nlist(num_vectors)},{codec}"
+    if kind == "hnsw":
+        # HNSW variants spell non-flat storage with an underscore: HNSW32_SQ8, HNSW32_PQ48
+        if codec == "Flat":
+            return f"HNSW{HNSW_M},Flat"
+        return f"HNSW{HNSW_M}_{codec.split('x')[0]}"
+    raise ValueError(f"Unknown index type: {kind}")
+
+def build_index(vectors, index_type=None, storage=None, block_size=65536):
+    """Build an inner-product index over normalized vectors, sized to the corpus.
+
+    `vectors` may be a memory-mapped array; it is normalized and added in blocks
+    so only one block is copied into memory at a time.
+    """
+    import faiss  # vector search
+    num_vectors, dimension = vectors.shape
+    kind = choose_index_type(num_vectors, index_type)
+    description = index_description(kind, dimension, num_vectors, storage)
+    index = faiss.index_factory(dimension, description, faiss.METRIC_INNER_PRODUCT)
+
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        index.hnsw.efSearch = DEFAULT_EF_SEARCH
+    if not index.is_trained:
+        # Training on more than 256 points per centroid does not improve quantizers
+        ivf = faiss.try_extract_index_ivf(index)
+        sample_size = min(num_vectors, max(ivf.nlist if ivf else 1, 256) * 256)
+        sample_ids = np.sort(np.random.default_rng(0).choice(num_vectors, sample_size, replace=False))
+        index.train(normalize_vectors(vectors[sample_ids]))
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = min(DEFAULT_NPROBE, ivf.nlist)
+
+    for start in range(0, num_vectors, block_size):
+        index.add(normalize_vectors(vectors[start:start + block_size]))
+    logging.info(f"Built {description} index over {num_vectors} vectors")
+    return index
+
+def incremental_index(dimension, index_type=None, storage=None):
+    """An empty index to add vectors to as they arrive, or None if the final one needs them all.
+
+    Only flat indexes with untrained storage qualify; ANN indexes are sized to the
+    corpus and SQ8/PQ are trained on a sample of it, so those are built at the end.
+    """
+    import faiss  # vector search
+    storage = storage or INDEX_STORAGE
+    if (index_type or INDEX_TYPE) not in ("auto", "flat") or storage not in ("float32", "float16"):
+        return None
+    return faiss.index_factory(dimension, STORAGE_CODECS[storage], faiss.METRIC_INNER_PRODUCT)
+
+def search_params(index, nprobe=None, ef_search=None):
+    """Per-query search parameters for IVF/HNSW indexes, or None for flat ones."""
+    import faiss  # vector search
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return faiss.SearchParametersIVF(nprobe=nprobe or ivf.nprobe)
+    if isinstance(index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(efSearch=ef_search or index.hnsw.efSearch)
+    return None
+
+def search_index(index, query_vectors, top_k, nprobe=None, ef_search=None):
+    """Search with normalized queries; returns (scores, indices) like index.search."""
+    queries = normalize_vectors(query_vectors)
+    params = search_params(index, nprobe, ef_search)
+    if params is None:
+        return index.search(queries, top_k)
+    return index.search(queries, top_k, params=params)
@@ -0,0 +1,339 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+import numpy as np
+from lexical import InvertedIndex
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking, so run a single server worker there
+    fcntl = None
+
+# On-disk store settings (override through the environment)
+VECTOR_STORE_DIR = os.environ.get("VECTOR_STORE_DIR", "vector_store")
+VECTOR_STORE_MAX_BYTES = int(os.environ.get("VECTOR_STORE_MAX_BYTES", str(2 * 1024 ** 3)))
+# Keep each document's float32 vectors next to its index, e.g. to rebuild it with other
+# settings. They count against VECTOR_STORE_MAX_BYTES like the rest of the entry
+VECTOR_STORE_KEEP_EMBEDDINGS = os.environ.get("VECTOR_STORE_KEEP_EMBEDDINGS", "0") == "1"
+
+CHUNKS_FILE = "chunks.bin"
+OFFSETS_FILE = "offsets.npy"
+POSITIONS_FILE = "positions.npy"
+EMBEDDINGS_FILE = "embeddings.npy"
+RAW_EMBEDDINGS_FILE = "embeddings.f32"
+INDEX_FILE = "index.faiss"
+META_FILE = "meta.json"
+LOCKS_DIR = ".locks"
+
+def hash_file(file_path, block_size=1024 * 1024):
+    """Return the SHA-256 hex digest of a file's bytes."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def document_key(file_hash, settings, model_name):
+    """Build the store key from the file hash, chunker/index settings and embedding model."""
+    settings = json.dumps(settings, sort_keys=True)
+    return hashlib.sha256(f"{file_hash}|{settings}|{model_name}".encode("utf-8")).hexdigest()
+
+class FileLock:
+    """Exclusive lock held across processes and threads through flock on a lock file.
+
+    With blocking=False, entering raises BlockingIOError instead of waiting
+    when someone else holds the lock.
+    """
+
+    def __init__(self, path, blocking=True):
+        self.path = path
+        self.blocking = blocking
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self.path, "a")
+        if fcntl is not None:
+            try:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | (0 if self.blocking else fcntl.LOCK_NB))
+            except OSError:
+                self._file.close()
+                self._file = None
+                raise
+        return self
+
+    def __exit__(self, *exc_info):
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._file.close()
+        self._file = None
+
+def read_mapped_index(path):
+    """Read a FAISS index whose vectors stay memory-mapped from disk.
+
+    IO_FLAG_MMAP alone only maps IVF lists; flat, SQ/PQ and HNSW storage is
+    copied into private memory, once per process. IO_FLAG_MMAP_IFC maps those
+    codes too, so every server worker shares one copy through the page cache.
+    """
+    import faiss  # vector search; loaded on first use rather than at server import
+    flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+    mmap_codes = getattr(faiss, "IO_FLAG_MMAP_IFC", 0)  # faiss >= 1.8
+    if mmap_codes:
+        try:
+            return faiss.read_index(path, flags | mmap_codes)
+        except RuntimeError:
+            # IVF indexes reject the flag; their lists are mapped by IO_FLAG_MMAP
+            pass
+    return faiss.read_index(path, flags)
+
+class MappedChunks:
+    """Read-only, memory-mapped list of chunk strings."""
+
+    def __init__(self, data_path, offsets_path):
+        self._offsets = np.load(offsets_path, mmap_mode="r")
+        if os.path.getsize(data_path) > 0:
+            self._data = np.memmap(data_path, dtype=np.uint8, mode="r")
+        else:
+            self._data = np.zeros(0, dtype=np.uint8)
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("chunk index out of range")
+        start, end = int(self._offsets[i]), int(self._offsets[i + 1])
+        return self._data[start:end].tobytes().decode("utf-8")
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+class StoredDocument:
+    """Chunks, embeddings and FAISS index of one ingested document."""
+
+    def __init__(self, key, chunks, embeddings, index, meta, positions=None, lexical=None):
+        self.key = key
+        self.chunks = chunks
+        # (start, end, page) of each chunk, when the chunker provided them
+        self.positions = positions
+        # BM25 inverted index over the same chunks
+        self.lexical = lexical
+        # Raw vectors, only with VECTOR_STORE_KEEP_EMBEDDINGS; search goes through the index
+        self.embeddings = embeddings
+        self.index = index
+        self.meta = meta
+
+class VectorStore:
+    """Content-addressed store of document indexes with a size cap and LRU eviction.
+
+    Safe to share between server worker processes. Entries never change once
+    published by an atomic rename, and readers memory-map them, so every worker
+    shares one copy through the page cache and sees a new document on its next
+    lookup. Publishing and eviction hold a store-wide file lock, and
+    ingest_lock() lets one worker ingest a document while the others wait for it.
+    """
+
+    def __init__(self, root=VECTOR_STORE_DIR, max_bytes=VECTOR_STORE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(root, LOCKS_DIR), exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.root, key)
+
+    def lock(self, name):
+        return FileLock(os.path.join(self.root, LOCKS_DIR, name))
+
+    def ingest_lock(self, key):
+        """Lock held while a document is ingested; striped so lock files stay few."""
+        return self.lock(f"ingest-{key[:2]}")
+
+    def get(self, key):
+        """Load a stored document memory-mapped, or return None if it is not stored."""
+        path = self._path(key)
+        if not os.path.exists(os.path.join(path, META_FILE)):
+            return None
+        try:
+            with open(os.path.join(path, META_FILE), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            chunks = MappedChunks(os.path.join(path, CHUNKS_FILE), os.path.join(path, OFFSETS_FILE))
+            embeddings_path = os.path.join(path, EMBEDDINGS_FILE)
+            embeddings = np.load(embeddings_path, mmap_mode="r") if os.path.exists(embeddings_path) else None
+            index = read_mapped_index(os.path.join(path, INDEX_FILE))
+            positions_path = os.path.join(path, POSITIONS_FILE)
+            positions = np.load(positions_path, mmap_mode="r") if os.path.exists(positions_path) else None
+            lexical = InvertedIndex.load(path)
+        except Exception as e:
+            logging.error(f"Error loading stored document {key}: {e}")
+            return None
+        # Directory mtime is the LRU clock
+        os.utime(path)
+        return StoredDocument(key, chunks, embeddings, index, meta, positions, lexical)
+
+    def touch(self, key):
+        """Mark a stored document as used; False if it has been evicted."""
+        try:
+            os.utime(self._path(key))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def put(self, key, chunks, embeddings, index, meta=None, positions=None, lexical=None):
+        """Persist a document's chunks and index, then enforce the size cap.
+
+        `positions` is an optional (n, 3) array of chunk (start, end, page) and
+        `lexical` an optional InvertedIndex over the chunks.
+        """
+        writer = self.writer(key)
+        try:
+            writer.add(chunks, embeddings, positions)
+            writer.finish(index, lexical, meta)
+        except Exception:
+            writer.abort()
+            raise
+
+    def writer(self, key):
+        """Start streaming a document into the store; see DocumentWriter."""
+        return DocumentWriter(self, key)
+
+    def _commit(self, tmp_path, key):
+        """Atomically move a finished entry into place."""
+        path = self._path(key)
+        with self._lock, self.lock("store"):
+            if os.path.exists(path):
+                # Same key means same content; keep the existing copy
+                shutil.rmtree(tmp_path, ignore_errors=True)
+            else:
+                os.replace(tmp_path, path)
+
+    def evict(self):
+        """Remove least recently used documents until the store fits in max_bytes.
+
+        An entry is renamed away before it is deleted, so a reader never opens a
+        half-removed one; readers that already mapped it keep their mappings.
+        """
+        with self._lock, self.lock("store"):
+            entries = []
+            total = 0
+            for name in os.listdir(self.root):
+                path = self._path(name)
+                # Skips in-progress writes, entries being removed and the lock files
+                if name.startswith(".") or not os.path.isdir(path):
+                    continue
+                # Every file counts, kept raw embeddings included
+                size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+                entries.append((os.path.getmtime(path), size, path))
+                total += size
+
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                logging.info(f"Evicting stored document {os.path.basename(path)} ({size} bytes)")
+                trash = os.path.join(self.root, f".trash-{uuid.uuid4().hex}")
+                try:
+                    os.replace(path, trash)
+                except OSError:
+                    continue
+                shutil.rmtree(trash, ignore_errors=True)
+                total -= size
+
+class DocumentWriter:
+    """Streams one document's chunks and embeddings into a temporary store entry.
+
+    Nothing is visible to readers until finish() renames the entry into place.
+    """
+
+    def __init__(self, store, key):
+        self.store = store
+        self.key = key
+        self.path = os.path.join(store.root, f".tmp-{key}-{uuid.uuid4().hex}")
+        os.makedirs(self.path)
+        self._chunks_file = open(os.path.join(self.path, CHUNKS_FILE), "wb")
+        self._vectors_file = open(os.path.join(self.path, RAW_EMBEDDINGS_FILE), "wb")
+        self._offsets = [0]
+        self._positions = []
+        self.count = 0
+        self.dimension = None
+
+    def add(self, chunks, embeddings, positions=None):
+        """Append chunk strings with their embeddings and optional (start, end, page)."""
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        if len(chunks) != len(embeddings):
+            raise ValueError("Every chunk needs exactly one embedding")
+        if len(chunks) == 0:
+            return
+        self.dimension = embeddings.shape[1]
+        for chunk in chunks:
+            encoded = chunk.encode("utf-8")
+            self._chunks_file.write(encoded)
+            self._offsets.append(self._offsets[-1] + len(encoded))
+        self._vectors_file.write(embeddings.tobytes())
+        if positions is not None:
+            self._positions.extend(tuple(p) for p in positions)
+        self.count += len(chunks)
+
+    def embeddings(self):
+        """Memory-mapped view of the embeddings written so far."""
+        self._vectors_file.flush()
+        if self.count == 0:
+            return np.zeros((0, self.dimension or 0), dtype=np.float32)
+        return np.memmap(
+            os.path.join(self.path, RAW_EMBEDDINGS_FILE), dtype=np.float32, mode="r",
+            shape=(self.count, self.dimension),
+        )
+
+    def finish(self, index, lexical=None, meta=None):
+        """Write the index and metadata, publish the entry and return it memory-mapped."""
+        self._chunks_file.close()
+        if VECTOR_STORE_KEEP_EMBEDDINGS:
+            raw = self.embeddings()
+            # Copy the raw vectors into a .npy in blocks so they never sit in memory at once
+            embeddings = np.lib.format.open_memmap(
+                os.path.join(self.path, EMBEDDINGS_FILE), mode="w+", dtype=np.float32,
+                shape=(self.count, self.dimension or 0),
+            )
+            for start in range(0, self.count, 65536):
+                embeddings[start:start + 65536] = raw[start:start + 65536]
+            embeddings.flush()
+            del embeddings, raw
+        self._vectors_file.close()
+        os.remove(os.path.join(self.path, RAW_EMBEDDINGS_FILE))
+
+        np.save(os.path.join(self.path, OFFSETS_FILE), np.array(self._offsets, dtype=np.int64))
+        if self._positions:
+            np.save(os.path.join(self.path, POSITIONS_FILE), np.array(self._positions, dtype=np.int64))
+        import faiss  # vector search
+        faiss.write_index(index, os.path.join(self.path, INDEX_FILE))
+        if lexical is not None:
+            lexical.save(self.path)
+        meta = dict(meta or {}, num_chunks=self.count, created=time.time())
+        with open(os.path.join(self.path, META_FILE), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+
+        self.store._commit(self.path, self.key)
+        # Load before evicting: mappings stay valid even if eviction removes the files
+        stored = self.store.get(self.key)
+        self.store.evict()
+        return stored
+
+    def abort(self):
+        for f in (self._chunks_file, self._vectors_file):
+            f.close()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+_store = None
+
+def get_vector_store():
+    """Return the process-wide vector store."""
+    global _store
+    if _store is None:
+        _store = VectorStore()
+    return _store
@@ -1,47 +1,32 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, UploadFile, File, Form
-from fastapi.middleware.cors import CORSMiddleware
-from main import send_request, process_file
+from fastapi import Request, WebSocket, WebSocketDisconnect, HTTPException
+from main import async_send_request, async_stream_request
+from app_factory import create_app
+from connections import ConnectionManager
+from uploads import receive_upload, get_job_manager, UploadTooLarge
+from scheduler import INTERACTIVE
 import logging
 import json
-import os
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 
-app = FastAPI()
+app = create_app()
 
-# Create uploads directory if it doesn't exist
-os.makedirs("uploads", exist_ok=True)
+# Replies are sent as plain text
+manager = ConnectionManager(json_messages=False)
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: list[WebSocket] = []
-
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
-        logging.info("New client connected")
-
-    def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
-        logging.info("Client disconnected")
-
-    async def send_message(self, message: str, websocket: WebSocket):
-        try:
-            await websocket.send_text(message)
-            logging.info(f"Message sent: {message[:100]}...")
-        except Exception as e:
-            logging.error(f"Error sending message: {e}")
-
-manager = ConnectionManager()
+def parse_json_request(data):
+    """A JSON message with "stream": true opts into streaming and one with
+    "type": "subscribe" follows an upload job; anything else is a plain prompt."""
+    if not data.lstrip().startswith("{"):
+        return None
+    try:
+        request = json.loads(data)
+    except ValueError:
+        return None
+    if not isinstance(request, dict):
+        return None
+    return request if request.get("stream") or request.get("type") == "subscribe" else None
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
@@ -49,43 +34,56 @@ async def websocket_endpoint(websocket: WebSocket):
 
     try:
         while True:
-            data = await websocket.receive_text()
+            data = await manager.receive_text(websocket)
             logging.info(f"Received message: {data[:100]}...")
             
             try:
-                # Process message using Ollama via send_request
-                response = send_request(data)
+                request = parse_json_request(data)
+                if request and request.get("type") == "subscribe":
+                    # Progress events for an upload job are pushed as JSON frames until it finishes
+                    await get_job_manager().subscribe(request.get("job_id"), manager.frame_sender(websocket))
+                    continue
+                if request:
+                    # Streamed as JSON token frames, then a `done` frame with timings
+                    frames = async_stream_request(request.get("prompt", ""), request.get("file_path"),
+                                                  hide_thinking=request.get("hide_thinking", False),
+                                                  priority=INTERACTIVE, on_queued=manager.queue_reporter(websocket),
+                                                  session=manager.session(websocket))
+                    await manager.run(websocket, manager.stream(websocket, frames))
+                    continue
+
+                # Process message using Ollama; cancelled if the client disconnects first
+                response = await manager.run(websocket, async_send_request(
+                    data, priority=INTERACTIVE, session=manager.session(websocket)))
                 logging.info(f"Response generated: {response[:100]}...")
                 
                 await manager.send_message(response, websocket)
+            except WebSocketDisconnect:
+                raise
             except Exception as e:
                 error_msg = f"Error processing message: {str(e)}"
                 logging.error(error_msg)
                 await manager.send_message(error_msg, websocket)
                 
     except WebSocketDisconnect:
+        get_job_manager().unsubscribe(manager.frame_sender(websocket))
         manager.disconnect(websocket)
 
 @app.post("/upload")
-async def upload_file(file: UploadFile = File(...), question: str = Form(...)):
+async def upload_file(request: Request):
+    # Multipart form with a `file` and the `question` to answer about it
     try:
-        # Create file path in uploads directory
-        file_path = os.path.join("uploads", file.filename)
-        
-        # Save uploaded file
-        with open(file_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
-        
-        logging.info(f"File saved: {file_path}")
-        
-        # Process file and generate response
-        response = send_request(question, file_path)
-        
-        # Clean up uploaded file
-        os.remove(file_path)
-        
-        return {"response": response}
+        # Stream the file into the uploads directory, named by its hash
+        file_path, document_id, size, filename, fields = await receive_upload(request)
+        logging.info(f"File saved: {file_path} ({size} bytes)")
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         logging.error(f"Upload error: {e}")
-        return {"error": str(e)}
\ No newline at end of file
+        return {"error": str(e)}
+    if "question" not in fields:
+        raise HTTPException(status_code=422, detail="Missing form field 'question'")
+
+    # Ingestion and the answer happen in the background; follow them over /ws or /jobs
+    job = get_job_manager().submit(file_path, document_id, filename, fields["question"])
+    return {"job_id": job.id, "document_id": document_id, "file_path": file_path, "status": job.status}
@@ -0,0 +1,195 @@
+import asyncio
+import functools
+import itertools
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import CancelledError, ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+# Worker pool settings (override through the environment)
+WORKER_PROCESSES = int(os.environ.get("WORKER_PROCESSES", os.environ.get("PDF_WORKERS", str(os.cpu_count() or 1))))
+# Threads for blocking work on the request path (prompt building, cache writes)
+REQUEST_THREADS = int(os.environ.get("REQUEST_THREADS", "16"))
+# Seconds one worker task (a page range, one OCR'd page) may take before its worker is killed
+WORKER_TASK_TIMEOUT = float(os.environ.get("WORKER_TASK_TIMEOUT", "120"))
+# How often a waiting caller checks whether its task has been picked up by a worker
+TASK_START_POLL_SECONDS = 0.5
+
+_task_starts = None  # in a worker process: the queue it reports task starts on
+
+def _init_worker(starts):
+    global _task_starts
+    _task_starts = starts
+
+def _run_task(task_id, fn, args):
+    """Runs in a worker: report the start first, so a task's timeout excludes time spent queued."""
+    _task_starts.put(task_id)
+    return fn(*args)
+
+class WorkerFailed(Exception):
+    """Raised when a task crashed its worker process or ran past its timeout."""
+
+class WorkerTask:
+    """A task submitted to a ManagedProcessPool."""
+
+    def __init__(self, pool, fn, args):
+        self.pool = pool
+        self.fn = fn
+        self.args = args
+        self.future, self.generation, self.task_id = pool._submit(fn, args)
+
+    def result(self, timeout=WORKER_TASK_TIMEOUT):
+        """The task's return value; raises WorkerFailed if its worker died or it timed out.
+
+        The timeout counts from when a worker picks the task up, so a backlog of
+        healthy tasks waiting for a free worker never times out. A crash can be
+        caused by another task sharing the pool, so a task whose pool broke under
+        it is retried once on the replacement pool.
+        """
+        try:
+            for attempt in range(2):
+                try:
+                    return self._wait(timeout)
+                except FutureTimeout:
+                    self.pool.restart(self.generation, f"{self.fn.__name__} ran past {timeout:.0f}s")
+                    raise WorkerFailed(f"{self.fn.__name__}{self.args} timed out after {timeout:.0f}s")
+                except (BrokenProcessPool, CancelledError):
+                    # Cancelled means another task's restart shut the pool down before this one ran
+                    self.pool.restart(self.generation, f"a worker died during {self.fn.__name__}")
+                    if attempt:
+                        raise WorkerFailed(f"{self.fn.__name__}{self.args} crashed its worker process")
+                    self.pool.forget(self.task_id)
+                    self.future, self.generation, self.task_id = self.pool._submit(self.fn, self.args)
+        finally:
+            self.pool.forget(self.task_id)
+
+    def _wait(self, timeout):
+        if timeout is None:
+            return self.future.result()
+        while True:
+            started = self.pool.started_at(self.task_id)
+            if started is None:
+                wait = TASK_START_POLL_SECONDS
+            else:
+                wait = started + timeout - time.monotonic()
+                if wait <= 0:
+                    raise FutureTimeout()
+            try:
+                return self.future.result(timeout=min(wait, TASK_START_POLL_SECONDS))
+            except FutureTimeout:
+                continue
+
+class ManagedProcessPool:
+    """Process pool for native extraction code (PyMuPDF, Tesseract) that outlives its workers.
+
+    A concurrent.futures pool is unusable once any worker dies, and a hung task
+    holds its worker forever. Here a crash or timeout fails just that task with
+    WorkerFailed and the pool's processes are replaced, so a corrupt file cannot
+    stall or take down the server. Workers are spawned, not forked, so they
+    never inherit the parent's torch/FAISS threads.
+    """
+
+    def __init__(self, max_workers=WORKER_PROCESSES):
+        self.max_workers = max_workers
+        self._executor = None
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._task_ids = itertools.count()
+        # Workers report each task they pick up on this queue; one per generation, so
+        # a worker killed while writing to it cannot jam the replacement pool's
+        self._starts = None
+        self._pending = set()  # ids of tasks not yet forgotten by their callers
+        self._started = {}  # task id -> monotonic time its start was seen
+
+    def _submit(self, fn, args):
+        with self._lock:
+            if self._executor is None:
+                context = multiprocessing.get_context("spawn")
+                self._starts = context.SimpleQueue()
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers, mp_context=context,
+                    initializer=_init_worker, initargs=(self._starts,),
+                )
+            executor, generation = self._executor, self._generation
+            task_id = next(self._task_ids)
+            self._pending.add(task_id)
+        try:
+            return executor.submit(_run_task, task_id, fn, args), generation, task_id
+        except BrokenProcessPool:
+            self.restart(generation, "the pool was already broken")
+            return self._submit(fn, args)
+
+    def started_at(self, task_id):
+        """When a worker was seen picking the task up, or None while it is still queued."""
+        with self._lock:
+            starts = self._starts
+            while starts is not None and not starts.empty():
+                started_id = starts.get()
+                if started_id in self._pending:
+                    self._started[started_id] = time.monotonic()
+            return self._started.get(task_id)
+
+    def forget(self, task_id):
+        """Stop tracking a task whose caller has its result (or gave up on it)."""
+        with self._lock:
+            self._pending.discard(task_id)
+            self._started.pop(task_id, None)
+
+    def submit(self, fn, *args):
+        return WorkerTask(self, fn, args)
+
+    def run(self, fn, *args, timeout=WORKER_TASK_TIMEOUT):
+        return self.submit(fn, *args).result(timeout)
+
+    def restart(self, generation, reason):
+        """Kill the pool's workers and start afresh, unless that generation was already replaced."""
+        with self._lock:
+            if generation != self._generation or self._executor is None:
+                return
+            executor, self._executor = self._executor, None
+            self._generation += 1
+            self._starts = None
+            self._started.clear()
+        logging.warning(f"Restarting extraction workers: {reason}")
+        # A hung worker never returns on its own; ProcessPoolExecutor has no public way to kill it
+        for process in list((executor._processes or {}).values()):
+            process.kill()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def warmup(self):
+        """Start the worker processes ahead of the first document (server startup)."""
+        for _ in range(self.max_workers):
+            _, _, task_id = self._submit(os.getpid, ())
+            self.forget(task_id)
+
+    def close(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+            self._starts = None
+            self._started.clear()
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+_process_pool = ManagedProcessPool()
+_thread_pool = None
+_thread_pool_lock = threading.Lock()
+
+def get_process_pool():
+    """Return the process-wide extraction pool."""
+    return _process_pool
+
+def get_thread_pool():
+    """Return the process-wide pool for blocking request-path work."""
+    global _thread_pool
+    with _thread_pool_lock:
+        if _thread_pool is None:
+            _thread_pool = ThreadPoolExecutor(max_workers=REQUEST_THREADS, thread_name_prefix="request")
+        return _thread_pool
+
+async def run_blocking(fn, *args, **kwargs):
+    """Run fn on the request thread pool without blocking the event loop."""
+    call = functools.partial(fn, *args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(get_thread_pool(), call)
@@ -69,6 +69,20 @@ export default function Home() {
     setAttachments(prev => prev.filter((_, i) => i !== index));
   };
 
+  const waitForJob = async (jobId: string) => {
+    while (true) {
+      const response = await fetch(`http://localhost:8000/jobs/${jobId}`);
+      if (!response.ok) {
+        throw new Error(`Job ${jobId} not found`);
+      }
+      const job = await response.json();
+      if (job.status === "done" || job.status === "failed") {
+        return job;
+      }
+      await new Promise(resolve => setTimeout(resolve, 1000));
+    }
+  };
+
   const handleSubmit = async (e: React.FormEvent) => {
     e.preventDefault();
     
@@ -102,7 +116,16 @@ export default function Home() {
           body: formData,
         });
         const data = await response.json();
-        handleWebSocketMessage(data.response);
+        if (!response.ok || data.error) {
+          throw new Error(data.detail || data.error || response.statusText);
+        }
+        // The upload is ingested and answered in the background; wait for its job
+        const job = await waitForJob(data.job_id);
+        if (job.status === "done") {
+          handleWebSocketMessage(job.response);
+        } else {
+          handleWebSocketError(job.error || "Failed to process file");
+        }
       } catch (error) {
         console.error("Upload error:", error);
         handleWebSocketError("Failed to upload file");